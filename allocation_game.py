@@ -17,11 +17,122 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
 
+import functools
+
 import numpy as np
 
 """Setup for environment: allocation game against Qlearning algorithm"""
 
 
+# independent seeds for games played in parallel, e.g. AllocationGame(seed=s) for s in spawn_seeds(seed, n)
+def spawn_seeds(seed, n):
+    return np.random.SeedSequence(seed).spawn(n)
+
+
+# hours a player can contribute: 0, hours_step, ..., max_hours
+def contribution_grid(max_hours=10, hours_step=2):
+    if max_hours % hours_step != 0:
+        raise ValueError("max_hours ({}) must be a multiple of hours_step ({})".format(max_hours, hours_step))
+    return list(range(0, max_hours + 1, hours_step))
+
+
+# payoffs of a player with given cost per hour, indexed by [own contribution][other player's contribution]
+def payoff_table(hours, threshold=8, bonus=25, cost=1):
+    return [[float((bonus if own + other >= threshold else 0) - cost * own) for other in hours] for own in hours]
+
+
+# highest sum of both players' payoffs, normalizes total payoff to efficiency
+def max_total_payoff(rewards_l, rewards_h):
+    n_actions = len(rewards_l)
+    highest = max(
+        rewards_l[action_l][action_h] + rewards_h[action_h][action_l]
+        for action_l in range(n_actions) for action_h in range(n_actions)
+    )
+    if highest <= 0:
+        raise ValueError("bonus does not pay for the threshold, total payoff is never positive")
+    return highest
+
+
+"""Binary snapshots: fixed-size records, arrays of them are saved and loaded as a whole"""
+
+player_types = ["low", "high"]
+
+# settings stored in a snapshot, those of the grid determine the size of the record
+snapshot_grid = ["max_hours", "hours_step", "threshold", "bonus", "cost_h", "cost_l"]
+snapshot_settings = [
+    "alpha0", "decay", "gamma_q", "exploration_periods", "max_periods", "sensitivity", "block_size"
+] + snapshot_grid
+
+# variables of a running game (besides Q values and random numbers)
+snapshot_variables = ["a", "b", "r", "count", "period", "contribution_h_old", "contribution_l_old"]
+
+# state of a PCG64 generator (default of np.random.default_rng), 128 bit numbers as two 64 bit halves
+rng_state_dtype = np.dtype([
+    ("state", np.uint64, 2),
+    ("inc", np.uint64, 2),
+    ("has_uint32", np.uint8),
+    ("uinteger", np.uint32),
+])
+
+
+@functools.lru_cache()
+def snapshot_dtype(n_actions):
+    return np.dtype(
+        [("player_type", np.uint8)]
+        + [(name, np.float64) for name in snapshot_settings]
+        + [("Q_values", np.float64, (n_actions, n_actions))]
+        + [(name, np.float64) for name in snapshot_variables]
+        + [
+            ("rng", rng_state_dtype),
+            ("uniforms_rng", rng_state_dtype),
+            ("uniform_pos", np.int64),
+            ("uniforms_drawn", np.bool_),
+            ("random_actions_rng", rng_state_dtype),
+            ("action_pos", np.int64),
+            ("random_actions_drawn", np.bool_),
+        ]
+    )
+
+
+def pack_rng_state(state):
+    if state["bit_generator"] != "PCG64":
+        raise ValueError("snapshots require a PCG64 generator, not {}".format(state["bit_generator"]))
+    mask = (1 << 64) - 1
+    return (
+        (state["state"]["state"] >> 64, state["state"]["state"] & mask),
+        (state["state"]["inc"] >> 64, state["state"]["inc"] & mask),
+        state["has_uint32"],
+        state["uinteger"],
+    )
+
+
+def unpack_rng_state(record):
+    high, low = record["state"].tolist()
+    inc_high, inc_low = record["inc"].tolist()
+    return {
+        "bit_generator": "PCG64",
+        "state": {"state": high << 64 | low, "inc": inc_high << 64 | inc_low},
+        "has_uint32": int(record["has_uint32"]),
+        "uinteger": int(record["uinteger"]),
+    }
+
+
+# stored float as int if it is a whole number (settings, counters and contributions are ints in a new game)
+def as_number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+# one file for any number of games with the same grid, e.g. 100,000 paused games
+def save_snapshots(path, games):
+    np.save(path, np.stack([game.snapshot() for game in games]))
+
+
+# array of snapshots, game i continues with AllocationGame.from_snapshot(snapshots[i])
+def load_snapshots(path, mmap_mode=None):
+    return np.load(path, mmap_mode=mmap_mode)
+
+
 class AllocationGame:
     def __init__(self,
                  alpha0=0.05,
@@ -30,34 +141,44 @@ class AllocationGame:
                  exploration_periods=100,
                  max_periods=1000,
                  sensitivity=0.1,
-                 player_type="low"):
+                 player_type="low",
+                 seed=None,
+                 block_size=1024,
+                 max_hours=10,
+                 hours_step=2,
+                 threshold=8,
+                 bonus=25,
+                 cost_h=3,
+                 cost_l=1):
         super(AllocationGame, self).__init__()
-        self.rewards_l = [
-            [0.0, 0.0, 0.0, 0.0, 25.0, 25.0],  # own contribution = 0
-            [-2.0, -2.0, -2.0, 23.0, 23.0, 23.0],  # own contribution = 2
-            [-4.0, -4.0, 21.0, 21.0, 21.0, 21.0],  # own contribution = 4
-            [-6.0, 19.0, 19.0, 19.0, 19.0, 19.0],  # own contribution = 6
-            [17.0] * 6,  # own contribution = 8
-            [15.0] * 6  # own contribution = 10
-        ]
-        self.rewards_h = [  # contribution 3x as costly as l
-            [0.0, 0.0, 0.0, 0.0, 25.0, 25.0],  # own contribution = 0
-            [-6.0, -6.0, -6.0, 19.0, 19.0, 19.0],  # own contribution = 2
-            [-12.0, -12.0, 13.0, 13.0, 13.0, 13.0],  # own contribution = 4
-            [-18.0, 7.0, 7.0, 7.0, 7.0, 7.0],  # own contribution = 6
-            [1.0] * 6,  # own contribution = 8
-            [-5.0] * 6  # own contribution = 10
-        ]
+
+        # grid of contributions and payoffs: bonus for both players if they work at least threshold hours in total
+        self.max_hours = max_hours
+        self.hours_step = hours_step
+        self.threshold = threshold
+        self.bonus = bonus
+        self.cost_h = cost_h  # cost per hour of player H
+        self.cost_l = cost_l  # cost per hour of player L
+        self.hours = contribution_grid(max_hours, hours_step)
+        self.n_actions = len(self.hours)
+
+        # default grid: 6 contributions of 0, 2, ..., 10 hours, contribution of H 3x as costly as of L
+        self.rewards_l = payoff_table(self.hours, threshold, bonus, cost_l)
+        self.rewards_h = payoff_table(self.hours, threshold, bonus, cost_h)
+
+        self.max_total_payoff = max_total_payoff(self.rewards_l, self.rewards_h)  # 42 on the default grid
 
         self.player_type = player_type  # "high" and "low" players have different marginal contribution costs
 
         if self.player_type == "low":
-            self.rewards_matrix = [self.rewards_l] * 6  # same payoff matrix for each of 6 states
+            self.rewards_matrix = [self.rewards_l] * self.n_actions  # same payoff matrix for each state
         else:
-            self.rewards_matrix = [self.rewards_h] * 6
+            self.rewards_matrix = [self.rewards_h] * self.n_actions
 
-        self.possible_actions = [[0, 1, 2, 3, 4, 5]] * 6  # own contribution each state
-        self.Q_values = np.full((6, 6), 0)  # create 6x6 matrix with entries of zero
+        self.possible_actions = [list(range(self.n_actions))] * self.n_actions  # own contribution each state
+        self.Q_values = np.zeros((self.n_actions, self.n_actions))  # matrix of floats with entries of zero
+        self.Q_max = [0.0] * self.n_actions  # cached maximum of each row of Q values
+        self.Q_argmax = [0] * self.n_actions  # cached position of each row's maximum (first one, like np.argmax)
 
         # hyperparameters
         self.alpha0 = alpha0  # initial learning rate
@@ -67,9 +188,19 @@ class AllocationGame:
         self.max_periods = max_periods  # maximum length of game
         self.sensitivity = sensitivity  # increment of changes to kindness
 
+        # random numbers of this game: own generator, drawn in blocks of block_size
+        self.rng = np.random.default_rng(seed)  # seed can be an int, a SeedSequence (see spawn_seeds) or a Generator
+        self.block_size = block_size
+        self.uniforms = []  # buffer for exploration decisions
+        self.uniform_pos = 0
+        self.uniforms_rng_state = None  # state of generator before the buffer was drawn, to draw it again (snapshot)
+        self.random_actions = []  # buffer for exploratory actions
+        self.action_pos = 0
+        self.random_actions_rng_state = None
+
         # preference parameters
-        self.a = np.random.rand()  # decision weight for advantageous inequality, "greed"
-        self.b = np.random.rand()  # d.w. for disadvantageous ineq., "envy"
+        self.a = self.rng.random()  # decision weight for advantageous inequality, "greed"
+        self.b = self.rng.random()  # d.w. for disadvantageous ineq., "envy"
 
         # initialization
         self.count = 0
@@ -78,49 +209,188 @@ class AllocationGame:
         self.period = 0
         self.r = 0  # initial kindness
 
+        self.profiler = None  # profiling.Profiler timing the phases of calculate (optional)
+
     # function that allows the algorithm to randomize in order to experience different game outcomes
     def epsilon_greedy_policy(self, state, epsilon):
-        if np.random.rand() < epsilon:
-            return np.random.choice(self.possible_actions[state])
+        if self.uniform_pos == len(self.uniforms):
+            self.refill_uniforms()
+        self.uniform_pos += 1
+
+        if self.uniforms[self.uniform_pos - 1] < epsilon:
+            if self.action_pos == len(self.random_actions):
+                self.refill_random_actions()
+            self.action_pos += 1
+            return self.possible_actions[state][self.random_actions[self.action_pos - 1]]
         else:
-            return np.argmax(self.Q_values[state])
+            return self.Q_argmax[state]
+
+    # draw the next block of uniform random numbers
+    def refill_uniforms(self):
+        self.uniforms_rng_state = self.rng.bit_generator.state
+        self.uniforms = self.rng.random(self.block_size).tolist()
+        self.uniform_pos = 0
+
+    # draw the next block of random positions in the list of possible actions (same length in each state)
+    def refill_random_actions(self):
+        self.random_actions_rng_state = self.rng.bit_generator.state
+        self.random_actions = self.rng.integers(0, len(self.possible_actions[0]), self.block_size).tolist()
+        self.action_pos = 0
+
+    # state of generator and buffers, to continue the same random sequence later (plain Python values only)
+    def random_state(self):
+        return {
+            "bit_generator": self.rng.bit_generator.state,
+            "uniforms": list(self.uniforms),
+            "uniform_pos": self.uniform_pos,
+            "random_actions": list(self.random_actions),
+            "action_pos": self.action_pos,
+            "uniforms_bit_generator": self.uniforms_rng_state,
+            "random_actions_bit_generator": self.random_actions_rng_state,
+        }
+
+    def set_random_state(self, state):
+        self.rng.bit_generator.state = state["bit_generator"]
+        self.uniforms = list(state["uniforms"])
+        self.uniform_pos = state["uniform_pos"]
+        self.random_actions = list(state["random_actions"])
+        self.action_pos = state["action_pos"]
+        self.uniforms_rng_state = state.get("uniforms_bit_generator")
+        self.random_actions_rng_state = state.get("random_actions_bit_generator")
+
+    # complete state of the game as one fixed-size record of snapshot_dtype(n_actions), see save_snapshots
+    # buffers of random numbers are not stored, but drawn again from the generator's state before they were drawn
+    def snapshot(self):
+        record = np.zeros((), dtype=snapshot_dtype(self.n_actions))
+        record["player_type"] = player_types.index(self.player_type)
+        for name in snapshot_settings:
+            record[name] = getattr(self, name)
+
+        record["Q_values"] = self.Q_values
+        for name in snapshot_variables:
+            record[name] = getattr(self, name)
+
+        record["rng"] = pack_rng_state(self.rng.bit_generator.state)
+        record["uniform_pos"] = self.uniform_pos
+        if self.uniforms:
+            record["uniforms_drawn"] = True
+            record["uniforms_rng"] = pack_rng_state(self.uniforms_rng_state)
+        record["action_pos"] = self.action_pos
+        if self.random_actions:
+            record["random_actions_drawn"] = True
+            record["random_actions_rng"] = pack_rng_state(self.random_actions_rng_state)
+        return record
+
+    # continue the game saved in a snapshot (same number of actions, grid settings and payoffs are restored)
+    def load_snapshot(self, record):
+        if record["Q_values"].shape != self.Q_values.shape:
+            raise ValueError("snapshot of a game with {} actions".format(len(record["Q_values"])))
+        self.player_type = player_types[record["player_type"]]
+        for name in snapshot_settings:
+            setattr(self, name, as_number(record[name]))
+
+        # tables derived from the grid settings, as in __init__
+        self.hours = contribution_grid(self.max_hours, self.hours_step)
+        self.rewards_l = payoff_table(self.hours, self.threshold, self.bonus, self.cost_l)
+        self.rewards_h = payoff_table(self.hours, self.threshold, self.bonus, self.cost_h)
+        self.max_total_payoff = max_total_payoff(self.rewards_l, self.rewards_h)
+        self.rewards_matrix = [self.rewards_l if self.player_type == "low" else self.rewards_h] * self.n_actions
+
+        self.Q_values[:] = record["Q_values"]
+        self.refresh_q_cache()
+        for name in snapshot_variables:
+            setattr(self, name, as_number(record[name]))
+
+        # draw buffers again, then continue from the generator's state at the time of the snapshot
+        if self.rng.bit_generator.state["bit_generator"] != "PCG64":
+            self.rng = np.random.default_rng()
+        self.uniforms = []
+        self.uniforms_rng_state = None
+        if record["uniforms_drawn"]:
+            self.rng.bit_generator.state = unpack_rng_state(record["uniforms_rng"])
+            self.refill_uniforms()
+        self.uniform_pos = int(record["uniform_pos"])
+        self.random_actions = []
+        self.random_actions_rng_state = None
+        if record["random_actions_drawn"]:
+            self.rng.bit_generator.state = unpack_rng_state(record["random_actions_rng"])
+            self.refill_random_actions()
+        self.action_pos = int(record["action_pos"])
+        self.rng.bit_generator.state = unpack_rng_state(record["rng"])
+
+    # new game from a snapshot
+    @classmethod
+    def from_snapshot(cls, record):
+        grid = {name: as_number(record[name]) for name in snapshot_grid}
+        game = cls(block_size=int(record["block_size"]), **grid)
+        game.load_snapshot(record)
+        return game
+
+    # write a single Q value and update the cached maximum of its row
+    def set_q_value(self, state, action, value):
+        self.Q_values[state, action] = value
+        best = self.Q_argmax[state]
+
+        if action == best:
+            if value >= self.Q_max[state]:  # maximum increased in place
+                self.Q_max[state] = value
+            else:  # maximum decreased, only case in which the row must be searched again
+                best = int(np.argmax(self.Q_values[state]))
+                self.Q_argmax[state] = best
+                self.Q_max[state] = float(self.Q_values[state, best])
+        elif value > self.Q_max[state] or (value == self.Q_max[state] and action < best):
+            self.Q_argmax[state] = action
+            self.Q_max[state] = value
+
+    # recompute the cached maxima after Q values were changed directly
+    def refresh_q_cache(self):
+        self.Q_argmax = [int(action) for action in np.argmax(self.Q_values, axis=1)]
+        self.Q_max = [float(value) for value in np.max(self.Q_values, axis=1)]
 
     # reset all variables
     def reset(self):
         self.count = 0  # change to global variable and remove from class?
         self.contribution_h_old = 0
         self.contribution_l_old = 0
-        self.a = np.random.rand()
-        self.b = np.random.rand()
+        self.a = self.rng.random()
+        self.b = self.rng.random()
         self.r = 0
         self.period = 0
 
         for state_q, actions_q in enumerate(self.possible_actions):
             self.Q_values[state_q, actions_q] = 0.0
+        self.refresh_q_cache()
 
     # advance the game one period
     def calculate(self, action):
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.clock()
+
         epsilon = max(1 - self.period / self.exploration_periods, 0.01)  # determine probability of random choice
 
         # determine computer agent's next action, accounting for player type
         if self.player_type == "low":
-            state_q = int(self.contribution_h_old / 2)  # determine previous state
+            state_q = int(self.contribution_h_old / self.hours_step)  # determine previous state
             action_q = self.epsilon_greedy_policy(state_q, epsilon)  # determine next action
 
-            contribution_l = 2 * action_q
-            contribution_h = 2 * action  # user's input
-            own_costs = contribution_l
-            other_costs = 3 * contribution_h
+            contribution_l = self.hours_step * action_q
+            contribution_h = self.hours_step * action  # user's input
+            own_costs = self.cost_l * contribution_l
+            other_costs = self.cost_h * contribution_h
         else:
-            state_q = int(self.contribution_l_old / 2)  # determine previous state
+            state_q = int(self.contribution_l_old / self.hours_step)  # determine previous state
             action_q = self.epsilon_greedy_policy(state_q, epsilon)  # determine next action
 
-            contribution_h = 2 * action_q
-            contribution_l = 2 * action  # user's input
-            other_costs = contribution_l
-            own_costs = 3 * contribution_h
+            contribution_h = self.hours_step * action_q
+            contribution_l = self.hours_step * action  # user's input
+            other_costs = self.cost_l * contribution_l
+            own_costs = self.cost_h * contribution_h
 
-        next_state = int(action / 2)  # convert user input into action
+        if profiler is not None:
+            start = profiler.add("calculate.policy", start)
+
+        next_state = int(action / self.hours_step)  # convert user input into action
 
         # update endgame counter
         if contribution_h == self.contribution_h_old and contribution_l == self.contribution_l_old:
@@ -129,8 +399,8 @@ class AllocationGame:
             self.count = 0
 
         # calculate reward and payoffs
-        if contribution_h + contribution_l >= 8:
-            bonus = 25
+        if contribution_h + contribution_l >= self.threshold:
+            bonus = self.bonus
         else:
             bonus = 0
 
@@ -145,10 +415,16 @@ class AllocationGame:
             reward_q = self.b * own_payoff + self.r * (1 - self.b) * other_payoff
             self.r = self.r - self.sensitivity
 
-        next_value = np.max(self.Q_values[next_state])  # determine best response to user's current action
+        if profiler is not None:
+            start = profiler.add("calculate.payoffs", start)
+
+        next_value = self.Q_max[next_state]  # determine best response to user's current action
         alpha = self.alpha0 / (1 + self.period * self.decay)  # determine learning rate
-        self.Q_values[state_q, action_q] *= 1 - alpha  # discount previous Q values
-        self.Q_values[state_q, action_q] += alpha * (reward_q + self.gamma_q * next_value)  # update Q values
+        q_value = self.Q_values[state_q, action_q] * (1 - alpha)  # discount previous Q values
+        self.set_q_value(state_q, action_q, q_value + alpha * (reward_q + self.gamma_q * next_value))  # update Q values
+
+        if profiler is not None:
+            profiler.add("calculate.q_update", start)
 
         # prepare next period
         self.contribution_h_old = contribution_h
@@ -162,3 +438,198 @@ class AllocationGame:
             done = False
 
         return other_payoff, own_payoff, contribution_h, contribution_l, reward_q, self.r, self.count, self.period, done
+
+
+"""Fast stepping path for headless simulation: same game, with payoffs and schedules looked up in tables"""
+
+
+class FastAllocationGame:
+    __slots__ = (
+        "player_type", "n_actions", "alpha0", "decay", "gamma_q", "exploration_periods", "max_periods",
+        "sensitivity", "own_payoffs", "other_payoffs", "epsilons", "alphas", "Q_values", "Q_max", "Q_argmax", "a",
+        "b", "r", "count", "rng", "block_size", "uniforms", "uniform_pos", "random_actions", "action_pos",
+        "period", "action_h_old", "action_l_old", "own_payoff", "other_payoff", "contribution_h", "contribution_l",
+        "reward_q", "hours", "next_states", "max_total_payoff",
+    )
+
+    def __init__(self,
+                 alpha0=0.05,
+                 decay=0.005,
+                 gamma_q=0.9,
+                 exploration_periods=100,
+                 max_periods=1000,
+                 sensitivity=0.1,
+                 player_type="low",
+                 seed=None,
+                 block_size=1024,
+                 max_hours=10,
+                 hours_step=2,
+                 threshold=8,
+                 bonus=25,
+                 cost_h=3,
+                 cost_l=1):
+        game = AllocationGame(alpha0, decay, gamma_q, exploration_periods, max_periods, sensitivity, player_type,
+                              seed, block_size, max_hours, hours_step, threshold, bonus, cost_h, cost_l)
+        self.player_type = player_type
+        self.n_actions = game.n_actions
+        self.hours = game.hours  # contribution of each action
+        self.next_states = [int(action / hours_step) for action in range(self.n_actions)]  # as in calculate
+        self.max_total_payoff = game.max_total_payoff
+
+        # hyperparameters
+        self.alpha0 = alpha0
+        self.decay = decay
+        self.gamma_q = gamma_q
+        self.exploration_periods = exploration_periods
+        self.max_periods = max_periods
+        self.sensitivity = sensitivity
+
+        # payoff tables indexed by [agent's action][user's action]
+        if player_type == "low":
+            own_rewards, other_rewards = game.rewards_l, game.rewards_h
+        else:
+            own_rewards, other_rewards = game.rewards_h, game.rewards_l
+        self.own_payoffs = [list(row) for row in own_rewards]
+        self.other_payoffs = [list(row) for row in zip(*other_rewards)]
+
+        # schedules of exploration probability and learning rate for each period of the game
+        self.epsilons = [max(1 - period / exploration_periods, 0.01) for period in range(max_periods)]
+        self.alphas = [alpha0 / (1 + period * decay) for period in range(max_periods)]
+
+        self.Q_values = [[0.0] * self.n_actions for _ in range(self.n_actions)]
+        self.Q_max = [0.0] * self.n_actions  # cached maximum of each row
+        self.Q_argmax = [0] * self.n_actions  # cached position of each row's maximum
+
+        # random numbers, drawn in blocks in the same order as in AllocationGame
+        self.rng = game.rng
+        self.block_size = block_size
+        self.uniforms = []
+        self.uniform_pos = 0
+        self.random_actions = []
+        self.action_pos = 0
+
+        # preference parameters
+        self.a = game.a
+        self.b = game.b
+
+        # initialization
+        self.r = 0
+        self.count = 0
+        self.period = 0
+        self.action_h_old = 0
+        self.action_l_old = 0
+
+        # outcome of last period
+        self.own_payoff = 0.0
+        self.other_payoff = 0.0
+        self.contribution_h = 0
+        self.contribution_l = 0
+        self.reward_q = 0.0
+
+    # reset all variables, reusing the Q table
+    def reset(self):
+        self.count = 0
+        self.action_h_old = 0
+        self.action_l_old = 0
+        self.a = self.rng.random()
+        self.b = self.rng.random()
+        self.r = 0
+        self.period = 0
+
+        for row in self.Q_values:
+            for action_q in range(self.n_actions):
+                row[action_q] = 0.0
+        for state_q in range(self.n_actions):
+            self.Q_max[state_q] = 0.0
+            self.Q_argmax[state_q] = 0
+
+    # advance the game one period, user's action must be an int between 0 and n_actions - 1, returns True if over
+    def step(self, action):
+        period = self.period
+        if period == len(self.epsilons):  # playing on after max_periods, as calculate allows: extend the schedules
+            self.epsilons.append(max(1 - period / self.exploration_periods, 0.01))
+            self.alphas.append(self.alpha0 / (1 + period * self.decay))
+
+        # state of computer agent is the user's previous action
+        if self.player_type == "low":
+            state_q = self.action_h_old
+        else:
+            state_q = self.action_l_old
+
+        # determine computer agent's next action
+        if self.uniform_pos == len(self.uniforms):
+            self.uniforms = self.rng.random(self.block_size).tolist()
+            self.uniform_pos = 0
+        self.uniform_pos += 1
+
+        if self.uniforms[self.uniform_pos - 1] < self.epsilons[period]:
+            if self.action_pos == len(self.random_actions):
+                self.random_actions = self.rng.integers(0, self.n_actions, self.block_size).tolist()
+                self.action_pos = 0
+            self.action_pos += 1
+            action_q = self.random_actions[self.action_pos - 1]
+        else:
+            action_q = self.Q_argmax[state_q]
+
+        if self.player_type == "low":
+            repeated = action == self.action_h_old and action_q == self.action_l_old
+            self.action_h_old = action
+            self.action_l_old = action_q
+        else:
+            repeated = action_q == self.action_h_old and action == self.action_l_old
+            self.action_h_old = action_q
+            self.action_l_old = action
+
+        # update endgame counter
+        if repeated:
+            self.count += 1
+        else:
+            self.count = 0
+
+        # look up payoffs
+        own_payoff = self.own_payoffs[action_q][action]
+        other_payoff = self.other_payoffs[action_q][action]
+
+        # determine computer agent's utility (cf. Charness & Rabin, 2002, QJE) and update kindness
+        r = self.r
+        if own_payoff >= other_payoff:
+            reward_q = self.a * own_payoff + r * (1 - self.a) * other_payoff
+            self.r = r + self.sensitivity
+        else:
+            reward_q = self.b * own_payoff + r * (1 - self.b) * other_payoff
+            self.r = r - self.sensitivity
+
+        # update Q value and cached maximum of its row (see AllocationGame.set_q_value)
+        next_value = self.Q_max[self.next_states[action]]
+        alpha = self.alphas[period]
+        row = self.Q_values[state_q]
+        value = row[action_q] * (1 - alpha) + alpha * (reward_q + self.gamma_q * next_value)
+        row[action_q] = value
+
+        best = self.Q_argmax[state_q]
+        if action_q == best:
+            if value >= self.Q_max[state_q]:
+                self.Q_max[state_q] = value
+            else:
+                value = max(row)
+                self.Q_max[state_q] = value
+                self.Q_argmax[state_q] = row.index(value)
+        elif value > self.Q_max[state_q] or (value == self.Q_max[state_q] and action_q < best):
+            self.Q_max[state_q] = value
+            self.Q_argmax[state_q] = action_q
+
+        # store outcome of this period
+        self.own_payoff = own_payoff
+        self.other_payoff = other_payoff
+        self.contribution_h = self.hours[self.action_h_old]
+        self.contribution_l = self.hours[self.action_l_old]
+        self.reward_q = reward_q
+        self.period = period + 1
+
+        return self.count >= 5 or self.period == self.max_periods
+
+    # same interface as AllocationGame.calculate
+    def calculate(self, action):
+        done = self.step(action)
+        return (self.other_payoff, self.own_payoff, self.contribution_h, self.contribution_l, self.reward_q, self.r,
+                self.count, self.period, done)
@@ -19,9 +19,6 @@
 
 import tkinter as tk
 
-# import auxiliary file for plotting dynamic variables
-import project_functions
-
 
 class MenuBar(tk.Menu):
     def __init__(self, parent):
@@ -34,27 +31,27 @@ class MenuBar(tk.Menu):
         file_menu.add_separator()
         file_menu.add_command(label="Exit", underline=1, command=parent.destroy)
 
-        # plot menu
+        # plot menu, selects diagram shown in the main window
         plot_menu = tk.Menu(self, tearoff=False)
         plot_menu.add_command(
             label='Total payoff',
-            command=lambda: project_functions.diagram1(parent.totpaydyn)
+            command=lambda: parent.show_plot("total_payoff")
         )
         plot_menu.add_command(
             label='Individual payoffs',
-            command=lambda: project_functions.diagram2(parent.indpayH, parent.indpayL)
+            command=lambda: parent.show_plot("individual_payoffs")
         )
         plot_menu.add_command(
             label='Individual contributions',
-            command=lambda: project_functions.diagram3(parent.indcontH, parent.indcontL)
+            command=lambda: parent.show_plot("individual_contributions")
         )
         plot_menu.add_command(
             label='Reward',
-            command=lambda: project_functions.diagram4(parent.reward_hist)
+            command=lambda: parent.show_plot("reward")
         )
         plot_menu.add_command(
             label='Kindness',
-            command=lambda: project_functions.diagram5(parent.kindness)
+            command=lambda: parent.show_plot("kindness")
         )
         self.add_cascade(
             label="History",
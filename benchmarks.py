@@ -0,0 +1,347 @@
+"""
+    Allocation Problem - Benchmark suite for game stepping, training and evaluation throughput
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import argparse
+import datetime
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from allocation_game import AllocationGame, FastAllocationGame
+from result_cache import ResultCache, code_version, default_directory, make_key
+
+# stored results of an earlier run, compared against by default
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# number of repetitions of each measurement, the best one is reported (least disturbed by other processes)
+default_repeat = 5
+
+
+# best time of repeat calls of function, in seconds
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+# one result: value, unit and whether larger values are better
+def result(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+"""Benchmarks: each returns a dict of results, scale multiplies the amount of work
+
+    The cache keeps simulated results only, never timings.
+"""
+
+
+def bench_game(scale, repeat, cache=None):
+    results = {}
+    n_steps = 20000 * scale
+    user_actions = np.random.default_rng(0).integers(0, 6, n_steps).tolist()  # same inputs in every run
+
+    for game_class, prefix in [(AllocationGame, "calculate"), (FastAllocationGame, "fast_calculate")]:
+        for player_type in ["low", "high"]:
+            def play():
+                game = game_class(max_periods=200, player_type=player_type, seed=0)
+                game.reset()
+                for action in user_actions:
+                    if game.calculate(action)[-1]:
+                        game.reset()
+
+            elapsed = best_time(play, repeat)
+            results["{}_{}".format(prefix, player_type)] = result(n_steps / elapsed, "steps/s", True)
+
+    game = AllocationGame(max_periods=200, seed=0)
+    n_resets = 2000 * scale
+
+    def reset():
+        for _ in range(n_resets):
+            game.reset()
+
+    results["reset"] = result(best_time(reset, repeat) / n_resets * 1e6, "us", False)
+    return results
+
+
+# game on a grid of n_actions contributions, threshold and bonus scaled like on the default grid of 6 actions
+def grid_settings(n_actions, hours_step=2):
+    max_hours = hours_step * (n_actions - 1)
+    return {"max_hours": max_hours, "hours_step": hours_step, "threshold": 0.8 * max_hours, "bonus": 2.5 * max_hours}
+
+
+def bench_grid(scale, repeat, cache=None, grid_sizes=(6, 26, 51, 101)):
+    results = {}
+    n_steps = 20000 * scale
+    n_games = 10 * scale
+
+    for n_actions in grid_sizes:
+        settings = grid_settings(n_actions)
+        user_actions = np.random.default_rng(0).integers(0, n_actions, n_steps).tolist()
+
+        def play():
+            game = FastAllocationGame(max_periods=200, seed=0, **settings)
+            game.reset()
+            for action in user_actions:
+                if game.step(action):
+                    game.reset()
+
+        elapsed = best_time(play, repeat)
+        results["grid{}_steps".format(n_actions)] = result(n_steps / elapsed, "steps/s", True)
+
+        # convergence: periods until the agent repeats its answer to a constant user (game ends after 5 repeats)
+        def convergence():
+            periods = []
+            for seed in range(n_games):
+                game = FastAllocationGame(max_periods=100000, seed=seed, **settings)
+                game.reset()
+                while not game.step(n_actions // 2):
+                    pass
+                periods.append(game.period)
+            return float(np.mean(periods))
+
+        if cache is not None:
+            key = make_key(result="grid_convergence", game=settings, n_games=n_games,
+                           code=code_version(inspect.getsourcefile(FastAllocationGame)))
+            mean_periods = cache.get_or_compute(key, convergence)
+        else:
+            mean_periods = convergence()
+        results["grid{}_convergence".format(n_actions)] = result(mean_periods, "periods", False)
+
+    return results
+
+
+def bench_policy(scale, repeat, cache=None):
+    import torch
+    from deepRL_vs_ag import create_policy, nn_hyperparameters, s_size
+    from numpy_policy import NumpyPolicy
+
+    torch.manual_seed(0)
+    policy, _ = create_policy(nn_hyperparameters["h_size"], nn_hyperparameters["lr"])
+    numpy_policy = NumpyPolicy(policy.state_dict(), seed=0)
+    states = np.random.default_rng(0).random((1000 * scale, s_size)) - 0.5
+
+    results = {}
+    for name, act in [("policy_act", policy.act), ("numpy_policy_act", numpy_policy.act)]:
+        def play():
+            for state in states:
+                act(state)
+
+        results[name] = result(best_time(play, repeat) / len(states) * 1e6, "us", False)
+    return results
+
+
+def bench_reinforce(scale, repeat, cache=None, h_sizes=(5, 16, 64)):
+    import torch
+    from deepRL_vs_ag import create_policy, nn_hyperparameters, reinforce
+
+    n_episodes = 4 * scale
+    results = {}
+    for h_size in h_sizes:
+        def train():
+            torch.manual_seed(0)
+            policy, optimizer = create_policy(h_size, nn_hyperparameters["lr"])
+            reinforce(policy, optimizer, n_episodes, nn_hyperparameters["max_t"], nn_hyperparameters["gamma"],
+                      n_episodes + 1, seed=0)
+
+        elapsed = best_time(train, repeat)
+        results["reinforce_h{}".format(h_size)] = result(n_episodes / elapsed, "episodes/s", True)
+    return results
+
+
+def bench_evaluate(scale, repeat, cache=None):
+    import torch
+    from deepRL_vs_ag import create_policy, evaluate_agent, nn_hyperparameters
+    from numpy_policy import NumpyPolicy
+
+    torch.manual_seed(0)
+    policy, _ = create_policy(nn_hyperparameters["h_size"], nn_hyperparameters["lr"])
+    numpy_policy = NumpyPolicy(policy.state_dict(), seed=0)
+    n_games = scale
+    settings = {"max_periods": 200, "exploration_periods": 100}  # full length games
+    max_steps = settings["max_periods"]
+
+    results = {}
+    for name, player in [("evaluate_agent", policy), ("evaluate_agent_numpy", numpy_policy)]:
+        def play():
+            for game in range(n_games):
+                evaluate_agent(max_steps, player, game_settings=settings, seed=game)
+
+        results[name] = result(best_time(play, repeat) / n_games * 1e3, "ms/game", False)
+    return results
+
+
+# GUI without a visible window, only possible if a display is available
+def bench_app(scale, repeat, cache=None):
+    import tkinter as tk
+
+    try:
+        from main import App
+        app = App()
+    except tk.TclError:  # no display
+        print("skipped app (no display)", file=sys.stderr)
+        return {}
+
+    app.withdraw()
+    app.exit_window = app.reset_program  # start a new game instead of opening the exit window
+    n_steps = 200 * scale
+    user_actions = np.random.default_rng(0).integers(0, 6, n_steps).tolist()
+
+    def play():
+        for action in user_actions:
+            app.next_step(action)
+        app.update()
+
+    results = {"app_next_step": result(best_time(play, repeat) / n_steps * 1e6, "us", False)}
+
+    # same with the live plot shown below the window
+    app.show_plot("individual_contributions")
+    results["app_next_step_plot"] = result(best_time(play, repeat) / n_steps * 1e6, "us", False)
+    app.destroy()
+    return results
+
+
+benchmarks = {
+    "game": bench_game,
+    "grid": bench_grid,
+    "policy": bench_policy,
+    "reinforce": bench_reinforce,
+    "evaluate": bench_evaluate,
+    "app": bench_app,
+}
+
+
+"Results"
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# machine and software the results were measured with
+def metadata(scale, repeat):
+    versions = {"python": platform.python_version(), "numpy": np.__version__}
+    try:
+        import torch
+        versions["torch"] = torch.__version__
+        torch_threads = torch.get_num_threads()
+    except ImportError:
+        torch_threads = None
+
+    return {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "system": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch_threads,
+        "versions": versions,
+        "scale": scale,
+        "repeat": repeat,
+    }
+
+
+def run(names, scale=1, repeat=default_repeat, cache=None):
+    results = {}
+    for name in names:
+        print("running {} ...".format(name), file=sys.stderr)
+        results.update(benchmarks[name](scale, repeat, cache))
+    return {"metadata": metadata(scale, repeat), "results": results}
+
+
+# relative change of each result present in both runs, positive if current is worse; returns list of regressions
+def compare(current, baseline, threshold):
+    regressions = []
+    print("{:<24}{:>14}{:>14}{:>10}  {}".format("benchmark", "baseline", "current", "change", "unit"))
+    for name, entry in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        old = baseline["results"][name]["value"]
+        new = entry["value"]
+        if entry["higher_is_better"]:
+            worse = old / new - 1
+        else:
+            worse = new / old - 1
+        flag = ""
+        if worse > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("{:<24}{:>14.4g}{:>14.4g}{:>+9.1%}  {}{}".format(name, old, new, -worse, entry["unit"], flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure throughput of game, training and evaluation")
+    parser.add_argument("--only", nargs="+", choices=list(benchmarks), default=list(benchmarks))
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the amount of work per measurement")
+    parser.add_argument("--repeat", type=int, default=default_repeat)
+    parser.add_argument("--output", default=None, help="file to write results to (JSON)")
+    parser.add_argument("--baseline", default=default_baseline, help="results to compare against (JSON)")
+    parser.add_argument("--save-baseline", action="store_true", help="store results as new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown counted as regression (default: 0.2)")
+    parser.add_argument("--cache", default=default_directory, help="directory of cached simulation results")
+    parser.add_argument("--no-cache", action="store_true", help="simulate again (timings are never cached)")
+    args = parser.parse_args(argv)
+
+    cache = None if args.no_cache else ResultCache(args.cache)
+    current = run(args.only, args.scale, args.repeat, cache)
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(current, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(current, file, indent=2)
+        print("saved baseline to {}".format(args.baseline))
+        return
+
+    if not os.path.exists(args.baseline):
+        print(json.dumps(current["results"], indent=2))
+        print("no baseline found at {} (create one with --save-baseline)".format(args.baseline))
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(current, baseline, args.threshold)
+    if regressions:
+        raise SystemExit("{} regression(s) beyond {:.0%}: {}".format(
+            len(regressions), args.threshold, ", ".join(regressions)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+    Allocation Problem - Auxiliary file to save checkpoints of long training runs in the background
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import os
+import queue
+import threading
+
+import torch
+
+
+# copy of nested dicts/lists with all tensors cloned to the CPU, so training can go on changing the originals
+def snapshot(value):
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key: snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(snapshot(item) for item in value)
+    return value
+
+
+# write checkpoint to a temporary file first, then replace the old one: a crash never leaves a broken file
+def save_atomic(checkpoint, path):
+    temporary = path + ".tmp"
+    torch.save(checkpoint, temporary)
+    os.replace(temporary, path)
+
+
+def load(path):
+    return torch.load(path, map_location="cpu")
+
+
+"""Writer thread: the training loop only pays for the snapshot, the file is written while training continues"""
+
+
+class AsyncCheckpointer:
+    def __init__(self, path):
+        self.path = path
+        self.pending = queue.Queue(maxsize=1)  # at most one checkpoint waits while another one is written
+        self.error = None
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_loop(self):
+        while True:
+            checkpoint = self.pending.get()
+            if checkpoint is None:
+                break
+            try:
+                save_atomic(checkpoint, self.path)
+            except Exception as error:  # reported to the training loop on next save or close
+                self.error = error
+
+    # hand a snapshot of the checkpoint to the writer thread
+    def save(self, checkpoint):
+        if self.error is not None:
+            raise self.error
+        self.pending.put(snapshot(checkpoint))
+
+    # wait until all checkpoints are written
+    def close(self):
+        if self.thread.is_alive():
+            self.pending.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+"""Checkpointer keeping the last checkpoint in memory, e.g. to continue a short training run later in another process"""
+
+
+class MemoryCheckpointer:
+    def __init__(self):
+        self.last = None
+
+    def save(self, checkpoint):
+        self.last = snapshot(checkpoint)
+
+    def close(self):
+        pass
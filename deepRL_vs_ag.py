@@ -28,6 +28,12 @@
 
 import numpy as np
 
+import argparse
+import inspect
+import multiprocessing as mp
+import os
+import queue
+import time
 from collections import deque
 
 # PyTorch
@@ -37,25 +43,33 @@ import torch.nn.functional as F
 import torch.optim as optim
 from torch.distributions import Categorical
 
-# import auxiliary file to plot evaluation results
-import project_functions
+# import recorder for evaluation results
+from trajectory import TrajectoryRecorder
 
-# import game environment
-from allocation_game import AllocationGame
+# import inference-only copy of policy
+from numpy_policy import NumpyPolicy
 
-# create instance of allocation game with set game duration
-ag = AllocationGame(max_periods=200)
+# import game environments
+from allocation_game import AllocationGame, contribution_grid, spawn_seeds
+from vec_allocation_game import VecAllocationGame
+
+# import cache of evaluated games
+from result_cache import ResultCache, code_version, default_directory, file_digest, make_key
+
+# settings of the allocation games played by the neural network, set game duration
+default_game_settings = {"max_periods": 200}
+
+# checkpoint file included with this project
+default_checkpoint = os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints", "deepRL_vs_ag_10000.pt")
 
 "Setup for neural network"
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
-print(device)
-
 # input
 s_size = 3  # state: two observed contribution values plus kindness
 
 # output
-eq_user_input = [0, 2, 4, 6, 8, 10]  # action: single contribution
+eq_user_input = contribution_grid()  # action: single contribution (0, 2, ..., 10 on the default grid)
 a_size = len(eq_user_input)  # output is mixture over possible actions (mixed strategy)
 
 
@@ -80,13 +94,84 @@ class Policy(nn.Module):
         return action.item(), m.log_prob(action)
 
 
-def reinforce(policy, optimizer, n_training_episodes, max_t, gamma, print_every):
+# discounted returns G_t = rewards_t + gamma * G_t+1 along first axis, via reversed cumulative sums over blocks
+# of periods (blocks are short enough that gamma ** block cannot underflow)
+def discounted_returns(rewards, gamma, block=128):
+    rewards = np.asarray(rewards, dtype=np.float64)
+    returns = np.empty_like(rewards)
+    if gamma == 0:
+        returns[:] = rewards
+        return returns
+    if gamma < 1:
+        block = max(1, min(block, int(-200 / np.log10(gamma))))
+
+    powers = gamma ** np.arange(block).reshape((block, ) + (1, ) * (rewards.ndim - 1))
+    carry = np.zeros(rewards.shape[1:])  # return of first period after current block
+    for stop in range(len(rewards), 0, -block):
+        start = max(stop - block, 0)
+        weights = powers[:stop - start]
+        tail = np.cumsum((rewards[start:stop] * weights)[::-1], axis=0)[::-1] / weights
+        returns[start:stop] = tail + gamma * weights[::-1] * carry
+        carry = returns[start]
+
+    return returns
+
+
+# log probabilities of played actions under the current policy, one forward pass for all periods
+# states (..., s_size) and actions (...): forward normalizes along dim 1, so all leading axes are flattened into rows
+def log_probs_of(policy, states, actions):
+    states = torch.as_tensor(states, dtype=torch.float32, device=device)
+    actions = torch.as_tensor(actions, device=device)
+    probs = policy.forward(states.reshape(-1, states.shape[-1]))
+    return Categorical(probs).log_prob(actions.reshape(-1)).reshape(actions.shape)
+
+
+# archive (optional): TrajectoryArchiveWriter that keeps every period of every episode on disk
+# game_settings (optional): arguments of AllocationGame other than seed, default_game_settings if None
+# checkpointer (optional): checkpoint.AsyncCheckpointer, saves every checkpoint_every episodes and after the last one
+# resume (optional): checkpoint saved this way, training continues after its episode with the same random numbers
+# profiler (optional): profiling.Profiler, times the phases of each episode and of the game's calculate function
+def reinforce(policy, optimizer, n_training_episodes, max_t, gamma, print_every, archive=None, game_settings=None,
+              seed=None, checkpointer=None, checkpoint_every=100, resume=None, profiler=None):
     # calculate score during training
     scores_deque = deque(maxlen=100)  # record of 100 tries
     scores = []
 
-    for i_episode in range(1, n_training_episodes + 1):
-        saved_log_probs = []
+    # create instance of allocation game
+    ag = AllocationGame(seed=seed, **(game_settings or default_game_settings))
+    ag.profiler = profiler
+    scale = ag.max_hours / 2  # contributions enter the network as contribution / scale - 0.5
+
+    # everything needed to continue training after the current episode
+    def training_state(i_episode):
+        state = {
+            'model_state_dict': policy.state_dict(),
+            'optimizer_state_dict': optimizer.state_dict(),
+            'episode': i_episode,
+            'scores': scores,
+            'scores_deque': list(scores_deque),
+            'torch_rng_state': torch.get_rng_state(),
+            'game_random_state': ag.random_state(),
+        }
+        if torch.cuda.is_available():
+            state['cuda_rng_state'] = torch.cuda.get_rng_state_all()
+        return state
+
+    start_episode = 0
+    if resume is not None:
+        policy.load_state_dict(resume['model_state_dict'])
+        optimizer.load_state_dict(resume['optimizer_state_dict'])
+        start_episode = resume['episode']
+        scores.extend(resume['scores'])
+        scores_deque.extend(resume['scores_deque'])
+        torch.set_rng_state(resume['torch_rng_state'])
+        if 'cuda_rng_state' in resume and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(resume['cuda_rng_state'])
+        ag.set_random_state(resume['game_random_state'])
+
+    for i_episode in range(start_episode + 1, n_training_episodes + 1):
+        states = []
+        actions = []
         rewards = []
         time_step = 0
 
@@ -94,53 +179,320 @@ def reinforce(policy, optimizer, n_training_episodes, max_t, gamma, print_every)
         state = np.zeros((s_size, ), dtype=int)  # one [s_size] previous payoff pair(s) of zero
 
         ag.reset()  # reset allocation game
+        if archive is not None:
+            archive.begin_episode()
 
         for t in range(max_t):  # play the game once
-            action, log_prob = policy.act(state)
-            saved_log_probs.append(log_prob)
+            if profiler is not None:
+                start = profiler.clock()
+
+            with torch.no_grad():  # gradients follow from a single forward pass after the game
+                action, _ = policy.act(state)
+            states.append(state)
+            actions.append(action)
+
+            if profiler is not None:
+                start = profiler.add("act", start)
 
             # input current action into calculate function
             payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r, count, period, done = ag.calculate(action)
 
+            if profiler is not None:
+                profiler.add("calculate", start)
+
+            if archive is not None:
+                archive.append(period, contribution_h, contribution_l, payoff_h, payoff_l, reward_q, r, count)
+
             # update state of network
-            state = np.array([contribution_h / 5 - 0.5, contribution_l / 5 - 0.5, r])
-            rewards.append((payoff_h + payoff_l)/42)
+            state = np.array([contribution_h / scale - 0.5, contribution_l / scale - 0.5, r])
+            rewards.append((payoff_h + payoff_l) / ag.max_total_payoff)
             time_step += 1
             if done:
                 break
 
+        if archive is not None:
+            archive.end_episode()
+
         # new elements [END]
 
         # track averages of collected rewards
         scores_deque.append(sum(rewards)/time_step)
         scores.append(sum(rewards)/time_step)
 
-        # calculate the discounted returns
-        returns = deque(maxlen=max_t)
-        n_steps = len(rewards)
+        if profiler is not None:
+            start = profiler.clock()
 
-        for t in range(n_steps)[::-1]:
-            disc_return_t = returns[0] if len(returns) > 0 else 0
-            returns.appendleft(gamma * disc_return_t + rewards[t])
+        # calculate the discounted returns
+        returns = discounted_returns(rewards, gamma)
+        returns = torch.tensor(returns - returns.mean(), dtype=torch.float32, device=device)
 
-        returns = torch.tensor(returns)
-        returns = returns - returns.mean()
+        if profiler is not None:
+            start = profiler.add("returns", start)
 
         # calculate loss of currently played mixed strategy
-        policy_loss = []
-        for log_prob, disc_return in zip(saved_log_probs, returns):
-            policy_loss.append(-log_prob * disc_return)
-        policy_loss = torch.cat(policy_loss).sum()
+        policy_loss = -(log_probs_of(policy, np.array(states), actions) * returns).sum()
+
+        if profiler is not None:
+            start = profiler.add("loss", start)
 
         # backward induction via gradient descent
         optimizer.zero_grad()
         policy_loss.backward()
+
+        if profiler is not None:
+            start = profiler.add("backward", start)
+
         optimizer.step()
 
+        if profiler is not None:
+            start = profiler.add("optimizer_step", start)
+
         # feedback about learning progress (average scores)
         if i_episode % print_every == 0:
             print("Episode {}\tAverage Score: {:.4f}".format(i_episode, np.mean(scores_deque)))
 
+        # hand a copy of the training state to the background writer
+        if checkpointer is not None and (i_episode % checkpoint_every == 0 or i_episode == n_training_episodes):
+            checkpointer.save(training_state(i_episode))
+
+        if profiler is not None:
+            profiler.add("checkpoint", start)
+            profiler.end_episode()
+
+    return scores
+
+
+# same as reinforce, but batch_size episodes are played in lockstep and share one update
+def reinforce_batched(policy, optimizer, n_training_episodes, max_t, gamma, print_every, batch_size,
+                      game_settings=None, seed=None):
+    # calculate score during training
+    scores_deque = deque(maxlen=100)  # record of 100 tries
+    scores = []
+
+    # batch of games with the same settings as the single game
+    vag = VecAllocationGame(batch_size, seed=seed, **(game_settings or default_game_settings))
+    scale = vag.max_hours / 2  # contributions enter the network as contribution / scale - 0.5
+
+    n_batches = -(-n_training_episodes // batch_size)  # round up to full batches
+
+    for i_batch in range(1, n_batches + 1):
+        n_episodes = min(batch_size, n_training_episodes - (i_batch - 1) * batch_size)  # last batch may be smaller
+        states = []
+        actions = []
+        rewards = []
+        masks = []
+
+        state = torch.zeros((batch_size, s_size), device=device)  # batch_size previous payoff pairs of zero
+        active = np.arange(batch_size) < n_episodes  # games that have not terminated yet (extra games never start)
+
+        vag.reset()  # reset allocation games
+
+        for t in range(max_t):  # play all games once, one batched forward pass per period
+            with torch.no_grad():  # gradients follow from a single forward pass after the games
+                action = Categorical(policy.forward(state)).sample()
+            states.append(state)
+            actions.append(action)
+
+            # input current actions into step function (finished games restart, but are masked out below)
+            payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r, count, period, done = vag.step(
+                action.cpu().numpy()
+            )
+
+            masks.append(active.copy())
+            rewards.append(np.where(active, (payoff_h + payoff_l) / vag.max_total_payoff, 0.0))
+            active &= ~done
+
+            # update state of network
+            state = np.stack([contribution_h / scale - 0.5, contribution_l / scale - 0.5, r], axis=1)
+            state = torch.from_numpy(state).float().to(device)
+            if not active.any():
+                break
+
+        rewards = np.array(rewards)[:, :n_episodes]  # shape (time steps, n_episodes)
+        masks = np.array(masks)[:, :n_episodes]
+
+        # track averages of collected rewards, one score per episode
+        for score in rewards.sum(axis=0) / masks.sum(axis=0):
+            scores_deque.append(score)
+            scores.append(score)
+
+        # calculate loss of currently played mixed strategies, averaged over episodes
+        policy_loss = batch_loss(policy, torch.stack(states)[:, :n_episodes], torch.stack(actions)[:, :n_episodes],
+                                 rewards, masks, gamma)
+
+        # backward induction via gradient descent
+        optimizer.zero_grad()
+        policy_loss.backward()
+        optimizer.step()
+
+        # feedback about learning progress (average scores)
+        n_trained = (i_batch - 1) * batch_size + n_episodes
+        if n_trained // print_every > ((i_batch - 1) * batch_size) // print_every:
+            print("Episode {}\tAverage Score: {:.4f}".format(n_trained, np.mean(scores_deque)))
+
+    return scores
+
+
+# loss of a batch of episodes of reinforce_batched, averaged over episodes
+# states (time steps, n_episodes, s_size); actions, rewards and masks (time steps, n_episodes)
+# masks mark the periods that were played
+def batch_loss(policy, states, actions, rewards, masks, gamma):
+    time_steps = masks.sum(axis=0)
+
+    # calculate the discounted returns of all episodes at once (rewards after termination are zero)
+    returns = discounted_returns(rewards, gamma)
+    returns = returns - returns.sum(axis=0) / time_steps  # center returns of each episode
+
+    returns = torch.tensor(returns, dtype=torch.float32, device=device)
+    masks = torch.tensor(masks, dtype=torch.float32, device=device)
+    return -(log_probs_of(policy, states, actions) * returns * masks).sum() / masks.shape[1]
+
+
+# worker process: plays episodes on a private game, using the latest policy weights received from the learner
+def rollout_worker(seed, h_size, max_t, game_settings, weight_queue, trajectory_queue, stop_event):
+    # deterministic random streams per worker, seed is a SeedSequence
+    torch.manual_seed(int(seed.generate_state(1)[0]))
+    torch.set_num_threads(1)  # one core per worker
+
+    game = AllocationGame(seed=seed, **game_settings)
+    scale = game.max_hours / 2
+    policy = Policy(s_size, game.n_actions, h_size)  # read-only copy on the CPU
+    weights = weight_queue.get()  # wait for initial weights
+
+    while not stop_event.is_set():
+        # keep only the most recent broadcast
+        try:
+            while True:
+                weights = weight_queue.get_nowait()
+        except queue.Empty:
+            pass
+        policy.load_state_dict({name: torch.from_numpy(value) for name, value in weights.items()})
+
+        states = []
+        actions = []
+        rewards = []
+        state = np.zeros((s_size, ))  # one [s_size] previous payoff pair(s) of zero
+
+        game.reset()  # reset allocation game
+
+        with torch.no_grad():
+            for t in range(max_t):  # play the game once
+                probs = policy.forward(torch.from_numpy(state).float().unsqueeze(0))
+                action = Categorical(probs).sample().item()
+                states.append(state)
+                actions.append(action)
+
+                # input current action into calculate function
+                payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r, count, period, done = game.calculate(
+                    action
+                )
+
+                # update state of network
+                state = np.array([contribution_h / scale - 0.5, contribution_l / scale - 0.5, r])
+                rewards.append((payoff_h + payoff_l) / game.max_total_payoff)
+                if done:
+                    break
+
+        trajectory = (np.array(states, dtype=np.float32), np.array(actions), np.array(rewards))
+
+        # hand trajectory to learner, but give up if training has finished in the meantime
+        while not stop_event.is_set():
+            try:
+                trajectory_queue.put(trajectory, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+
+# learner: n_workers processes generate trajectories, which are combined into one update per batch_size episodes
+def reinforce_parallel(policy, optimizer, n_training_episodes, max_t, gamma, print_every, n_workers, batch_size,
+                       broadcast_every=1, game_settings=None, seed=0):
+    # calculate score during training
+    scores_deque = deque(maxlen=100)  # record of 100 tries
+    scores = []
+
+    # every worker plays with the same settings as the single game
+    game_settings = game_settings or default_game_settings
+    h_size = policy.fc1.out_features
+
+    # independent seeds derived from a single seed, one per worker
+    worker_seeds = spawn_seeds(seed, n_workers)
+
+    # fresh interpreters instead of forked copies of the learner (torch threads and CUDA do not survive fork)
+    context = mp.get_context("spawn")
+    weight_queues = [context.Queue() for _ in range(n_workers)]
+    trajectory_queue = context.Queue(maxsize=2 * batch_size)
+    stop_event = context.Event()
+    workers = [
+        context.Process(
+            target=rollout_worker,
+            args=(worker_seeds[i], h_size, max_t, game_settings, weight_queues[i], trajectory_queue, stop_event),
+            daemon=True,
+        )
+        for i in range(n_workers)
+    ]
+
+    # send current weights to all workers
+    def broadcast():
+        weights = {name: value.detach().cpu().numpy().copy() for name, value in policy.state_dict().items()}
+        for weight_queue in weight_queues:
+            weight_queue.put(weights)
+
+    for worker in workers:
+        worker.start()
+    broadcast()
+
+    try:
+        i_episode = 0
+        n_updates = 0
+
+        while i_episode < n_training_episodes:
+            batch = [trajectory_queue.get() for _ in range(min(batch_size, n_training_episodes - i_episode))]
+
+            batch_states = []
+            batch_actions = []
+            batch_returns = []
+
+            for states, actions, rewards in batch:
+                i_episode += 1
+
+                # track averages of collected rewards
+                scores_deque.append(rewards.sum() / len(rewards))
+                scores.append(rewards.sum() / len(rewards))
+
+                # calculate the discounted returns
+                returns = discounted_returns(rewards, gamma)
+
+                batch_states.append(states)
+                batch_actions.append(actions)
+                batch_returns.append(returns - returns.mean())
+
+                # feedback about learning progress (average scores)
+                if i_episode % print_every == 0:
+                    print("Episode {}\tAverage Score: {:.4f}".format(i_episode, np.mean(scores_deque)))
+
+            # log probabilities of all played actions in a single forward pass
+            returns = torch.tensor(np.concatenate(batch_returns), dtype=torch.float32, device=device)
+            log_probs = log_probs_of(policy, np.concatenate(batch_states), np.concatenate(batch_actions))
+
+            # loss of the played mixed strategies, averaged over episodes
+            policy_loss = -(log_probs * returns).sum() / len(batch)
+
+            # backward induction via gradient descent
+            optimizer.zero_grad()
+            policy_loss.backward()
+            optimizer.step()
+
+            n_updates += 1
+            if n_updates % broadcast_every == 0:
+                broadcast()
+    finally:
+        stop_event.set()
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
     return scores
 
 
@@ -151,87 +503,507 @@ nn_hyperparameters = {
     "max_t": 1000,  # maximum game length (overridden by allocation game)
     "gamma": 0.99,  # discount factor
     "lr": 1e-2,  # learning rate
+    "batch_size": 32,  # episodes per update in batched and parallel training
+    "n_workers": 4,  # rollout processes in parallel training
+    "broadcast_every": 1,  # updates between weight broadcasts in parallel training
     "state_space": s_size,
     "action_space": a_size,
 }
 
-# Create policy and place it to the device
-nn_policy = Policy(
-    nn_hyperparameters["state_space"],
-    nn_hyperparameters["action_space"],
-    nn_hyperparameters["h_size"],
-).to(device)
-nn_optimizer = optim.Adam(nn_policy.parameters(), lr=nn_hyperparameters["lr"])
-
-# train the neural network
-# scores = reinforce(
-#     nn_policy,
-#     nn_optimizer,
-#     nn_hyperparameters["n_training_episodes"],
-#     nn_hyperparameters["max_t"],
-#     nn_hyperparameters["gamma"],
-#     10,
-# )
-
-# save the trained model
-# torch.save({
-#     'model_state_dict': nn_policy.state_dict(),
-#     'optimizer_state_dict': nn_optimizer.state_dict()
-# }, "deepRL_vs_ag_10000.pt")
-
-# load a saved checkpoint
-checkpoint = torch.load("checkpoints/deepRL_vs_ag_10000.pt")
-nn_policy.load_state_dict(checkpoint['model_state_dict'])
-nn_optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+
+# play one batch of games and compare batch_loss with the losses of the same episodes computed as in reinforce
+# returns the largest differences of log probabilities and of the loss
+def check_batch_loss(policy, n_episodes=8, max_t=nn_hyperparameters["max_t"], gamma=nn_hyperparameters["gamma"],
+                     game_settings=None, seed=0):
+    vag = VecAllocationGame(n_episodes, seed=seed, **(game_settings or default_game_settings))
+    scale = vag.max_hours / 2
+    states = []
+    actions = []
+    rewards = []
+    masks = []
+
+    state = torch.zeros((n_episodes, s_size), device=device)
+    active = np.ones(n_episodes, dtype=bool)
+    vag.reset()
+    with torch.no_grad():
+        for t in range(max_t):
+            action = Categorical(policy.forward(state)).sample()
+            states.append(state)
+            actions.append(action)
+            payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r, count, period, done = vag.step(
+                action.cpu().numpy()
+            )
+            masks.append(active.copy())
+            rewards.append(np.where(active, (payoff_h + payoff_l) / vag.max_total_payoff, 0.0))
+            active &= ~done
+            state = np.stack([contribution_h / scale - 0.5, contribution_l / scale - 0.5, r], axis=1)
+            state = torch.from_numpy(state).float().to(device)
+            if not active.any():
+                break
+
+        states = torch.stack(states)
+        actions = torch.stack(actions)
+        rewards = np.array(rewards)
+        masks = np.array(masks)
+        log_probs = log_probs_of(policy, states, actions)
+        loss = batch_loss(policy, states, actions, rewards, masks, gamma)
+
+        # serial version: one episode at a time, as in reinforce
+        log_prob_difference = 0.0
+        serial_loss = 0.0
+        for i in range(n_episodes):
+            n_steps = int(masks[:, i].sum())
+            episode_states = states[:n_steps, i].cpu().numpy()
+            episode_actions = actions[:n_steps, i].cpu().numpy()
+            returns = discounted_returns(rewards[:n_steps, i], gamma)
+            returns = torch.tensor(returns - returns.mean(), dtype=torch.float32, device=device)
+            episode_log_probs = log_probs_of(policy, episode_states, episode_actions)
+            serial_loss += float(-(episode_log_probs * returns).sum()) / n_episodes
+            log_prob_difference = max(log_prob_difference,
+                                      float((episode_log_probs - log_probs[:n_steps, i]).abs().max()))
+
+    return log_prob_difference, abs(float(loss) - serial_loss)
+
+
+# create policy and its optimizer on the device, optionally with weights from a saved checkpoint
+# n_actions: size of the output, must match the contribution grid of the games played (default grid: a_size)
+def create_policy(h_size, lr, checkpoint=None, n_actions=a_size):
+    policy = Policy(s_size, n_actions, h_size).to(device)
+    optimizer = optim.Adam(policy.parameters(), lr=lr)
+
+    if checkpoint is not None:
+        saved = torch.load(checkpoint, map_location=device)
+        policy.load_state_dict(saved['model_state_dict'])
+        optimizer.load_state_dict(saved['optimizer_state_dict'])
+
+    return policy, optimizer
+
 
 "Evaluation"
 
-# prepare lists for data collection
-totpaydyn = []
-indpayH = []
-indpayL = []
-indcontH = []
-indcontL = []
-kindness = []
-reward_hist = []
 
+# play one game and collect same data as GUI version, returns TrajectoryRecorder
+# policy: Policy or NumpyPolicy (faster, if no gradients are needed)
+# profiler (optional): profiling.Profiler, times the phases of each period and of the game's calculate function
+def evaluate_agent(max_steps, policy, archive=None, game_settings=None, seed=None, profiler=None):
+    ag = AllocationGame(seed=seed, **(game_settings or default_game_settings))
+    ag.profiler = profiler
+    history = TrajectoryRecorder(ag.max_periods, ag.max_total_payoff)
+    scale = ag.max_hours / 2
 
-def evaluate_agent(max_steps, policy):
     state = np.zeros((s_size, ), dtype=int)  # reset state
     ag.reset()  # reset game
+    if archive is not None:
+        archive.begin_episode()
 
     for step in range(max_steps):  # play the game once and collect same data as GUI version
+        if profiler is not None:
+            start = profiler.clock()
+
         action, _ = policy.act(state)
 
+        if profiler is not None:
+            start = profiler.add("act", start)
+
         # input action into calculate function
         payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r, count, period, done = ag.calculate(action)
 
+        if profiler is not None:
+            start = profiler.add("calculate", start)
+
         # update payoff histories for plots
-        totpaydyn.append(payoff_h + payoff_l)
-        indpayL.append(payoff_l)
-        indpayH.append(payoff_h)
-        indcontL.append(contribution_l)
-        indcontH.append(contribution_h)
-        reward_hist.append(reward_q)
-        kindness.append(r)
+        history.append(payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r)
+        if archive is not None:
+            archive.append(period, contribution_h, contribution_l, payoff_h, payoff_l, reward_q, r, count)
+
+        if profiler is not None:
+            profiler.add("record", start)
 
         if done:
             break
 
-        state = np.array([contribution_h/5 - 0.5, contribution_l/5 - 0.5, r])
+        state = np.array([contribution_h/scale - 0.5, contribution_l/scale - 0.5, r])
+
+    if archive is not None:
+        archive.end_episode()
+    if profiler is not None:
+        profiler.end_episode()
+
+    return history
+
+
+# metrics of the exit window of the GUI, one value per game
+evaluation_metrics = ["avg_reward", "avg_efficiency", "avg_contribution_h", "avg_contribution_l", "periods"]
+
+
+# percentile bootstrap confidence intervals of the means of each column of values, shape (n, n_metrics)
+def bootstrap_ci(values, confidence=0.95, n_bootstrap=1000, rng=None):
+    rng = np.random.default_rng(rng)
+    n = len(values)
+    chunk = max(1, 10 ** 7 // n)  # resamples at once, bounds memory of counts
+    means = np.concatenate([
+        rng.multinomial(n, np.full(n, 1 / n), size=min(chunk, n_bootstrap - i)) @ values / n  # counts of games drawn
+        for i in range(0, n_bootstrap, chunk)
+    ])  # shape (n_bootstrap, n_metrics)
+    tail = (1 - confidence) / 2 * 100
+    return np.percentile(means, tail, axis=0), np.percentile(means, 100 - tail, axis=0)
+
+
+# play up to n_episodes games with fresh preference draws, batch_size games at a time (NumPy copy of the policy)
+# ci_width: {metric: width}, stops early once these confidence intervals are narrow enough (after min_episodes games)
+def evaluate_batched(max_steps, policy, n_episodes=nn_hyperparameters["n_evaluation_episodes"], batch_size=100,
+                     game_settings=None, seed=None, ci_width=None, confidence=0.95, min_episodes=20):
+    if not isinstance(policy, NumpyPolicy):
+        policy = NumpyPolicy(policy.state_dict())
+
+    game_seed, policy_seed, bootstrap_seed = spawn_seeds(seed, 3)
+    rng = np.random.default_rng(policy_seed)
+    widths = [(evaluation_metrics.index(name), width) for name, width in (ci_width or {}).items()]
+
+    vag = None
+    batches = []
+    ci = None  # intervals of all games played so far, only computed when needed
+    n_played = 0
+    while n_played < n_episodes:
+        n_games = min(batch_size, n_episodes - n_played)
+        if vag is None or vag.n_games != n_games:  # smaller last batch continues the same random numbers
+            vag = VecAllocationGame(n_games, seed=game_seed if vag is None else vag.rng,
+                                    **(game_settings or default_game_settings))
+        scale = vag.max_hours / 2
+
+        sums = np.zeros((n_games, len(evaluation_metrics)))  # sums over periods, last column counts periods
+        state = np.zeros((n_games, s_size))
+        active = np.ones(n_games, dtype=bool)
+        vag.reset()  # new preference parameters for every game
+
+        for step in range(max_steps):
+            payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r, count, period, done = vag.step(
+                policy.sample(state, rng)
+            )
+
+            # games that finished earlier were restarted by vag.step and are not counted
+            sums[active] += np.stack([
+                reward_q, (payoff_h + payoff_l) / vag.max_total_payoff, contribution_h, contribution_l,
+                np.ones(n_games),
+            ], axis=1)[active]
+            active &= ~done
+            if not active.any():
+                break
 
+            state = np.stack([contribution_h / scale - 0.5, contribution_l / scale - 0.5, r], axis=1)
 
-evaluate_agent(nn_hyperparameters["max_t"], nn_policy)
+        sums[:, :-1] /= sums[:, -1:]  # averages per period, like TrajectoryRecorder
+        batches.append(sums)
+        n_played += n_games
 
-# data shown on exit screen of GUI version
-# print(round(np.sum(reward_hist) / len(reward_hist), 2))
-# print(round(np.sum(totpaydyn) / (len(totpaydyn) * 42), 2))
-# print(round(np.sum(indcontH) / len(indcontH), 2))
-# print(round(np.sum(indcontL) / len(indcontL), 2))
+        ci = None
+        if widths and n_played >= min_episodes:
+            ci = bootstrap_ci(np.concatenate(batches), confidence, rng=bootstrap_seed)
+            if all(ci[1][i] - ci[0][i] <= width for i, width in widths):
+                break
 
-# plot functions also available in GUI version
-# project_functions.diagram1(totpaydyn)  # total payoffs
-# project_functions.diagram2(indpayH, indpayL)  # individual payoffs
-project_functions.diagram3(indcontH, indcontL)  # individual contributions
-# project_functions.diagram4(reward_hist)  # rewards earned by Q learning algorithm
-# project_functions.diagram5(kindness)  # kindness
+    values = np.concatenate(batches)
+    low, high = ci if ci is not None else bootstrap_ci(values, confidence, rng=bootstrap_seed)
+    return {
+        "episodes": n_played,
+        "values": {name: values[:, i] for i, name in enumerate(evaluation_metrics)},
+        "mean": {name: float(values[:, i].mean()) for i, name in enumerate(evaluation_metrics)},
+        "ci": {name: (float(low[i]), float(high[i])) for i, name in enumerate(evaluation_metrics)},
+        "confidence": confidence,
+    }
+
+
+"Command line"
+
+
+def train_command(args):
+    if args.mode != "serial":
+        for option, value in [("--archive", args.archive), ("--checkpoint-every", args.checkpoint_every),
+                              ("--resume", args.resume), ("--profile", args.profile)]:
+            if value:
+                raise SystemExit("{} is only available in serial mode".format(option))
+    if args.mode == "parallel" and args.seed is None:
+        args.seed = 0  # workers need a seed for their games, use the same one for the initial weights
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+
+    policy, optimizer = create_policy(args.h_size, args.lr, args.init)
+
+    if args.mode == "serial":
+        import checkpoint
+
+        resume = None
+        if args.resume:
+            resume = checkpoint.load(args.checkpoint)
+            if 'episode' not in resume:
+                raise SystemExit("{} was not saved with --checkpoint-every".format(args.checkpoint))
+
+        archive = None
+        if args.archive is not None:
+            from trajectory_archive import TrajectoryArchiveWriter
+            archive = TrajectoryArchiveWriter(args.archive)
+
+        profiler = None
+        if args.profile is not None:
+            from profiling import Profiler
+            profiler = Profiler()
+
+        checkpointer = None
+        if args.checkpoint_every or args.resume:
+            checkpointer = checkpoint.AsyncCheckpointer(args.checkpoint)
+
+        reinforce(policy, optimizer, args.episodes, args.max_t, args.gamma, args.print_every, archive=archive,
+                  seed=args.seed, checkpointer=checkpointer, checkpoint_every=args.checkpoint_every or 100,
+                  resume=resume, profiler=profiler)
+        if archive is not None:
+            archive.close()
+        if profiler is not None:
+            print(profiler.summary())
+            profiler.write_chrome_trace(args.profile)
+
+        if checkpointer is not None:
+            # periodic checkpoints replace the file, the last one is saved after the final episode
+            checkpointer.close()
+            return
+    elif args.mode == "batched":
+        reinforce_batched(policy, optimizer, args.episodes, args.max_t, args.gamma, args.print_every,
+                          args.batch_size, seed=args.seed)
+    else:
+        reinforce_parallel(policy, optimizer, args.episodes, args.max_t, args.gamma, args.print_every, args.workers,
+                           args.batch_size, args.broadcast_every, seed=args.seed)
+
+    # save the trained model
+    torch.save({
+        'model_state_dict': policy.state_dict(),
+        'optimizer_state_dict': optimizer.state_dict()
+    }, args.checkpoint)
+
+
+# key of an evaluated game in the result cache: same policy, seed and code play the same game
+def evaluation_key(args):
+    classes = (AllocationGame, VecAllocationGame, NumpyPolicy, TrajectoryRecorder)
+    sources = [__file__] + [inspect.getsourcefile(cls) for cls in classes]
+    return make_key(
+        result="evaluate",
+        checkpoint=file_digest(args.checkpoint),
+        backend=args.backend,
+        h_size=args.h_size,
+        max_t=args.max_t,
+        seed=args.seed,
+        episodes=args.episodes,
+        batch_size=args.batch_size,
+        ci_width=args.ci_width,
+        confidence=args.confidence,
+        min_episodes=args.min_episodes,
+        code=code_version(*sources),
+    )
+
+
+def evaluate_command(args):
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+    if args.ci_width is not None:
+        args.ci_width = parse_ci_width(args.ci_width)
+    if args.episodes > 1:
+        evaluate_batched_command(args)
+        return
+
+    # seeded games are cached, unless their periods are archived or timed
+    cache = None
+    history = None
+    if args.seed is not None and args.archive is None and args.profile is None and not args.no_cache:
+        cache = ResultCache(args.cache)
+        key = evaluation_key(args)
+        history = cache.get(key)
+
+    if history is None:
+        # independent random numbers of game and policy (the same seed would give both the same stream)
+        game_seed, policy_seed = spawn_seeds(args.seed, 2)
+        if args.backend == "numpy":
+            policy = NumpyPolicy.from_checkpoint(args.checkpoint, seed=policy_seed)  # no gradients needed
+        else:
+            policy, _ = create_policy(args.h_size, nn_hyperparameters["lr"], args.checkpoint)
+
+        archive = None
+        if args.archive is not None:
+            from trajectory_archive import TrajectoryArchiveWriter
+            archive = TrajectoryArchiveWriter(args.archive)
+        profiler = None
+        if args.profile is not None:
+            from profiling import Profiler
+            profiler = Profiler()
+
+        history = evaluate_agent(args.max_t, policy, archive=archive, seed=game_seed, profiler=profiler)
+        if archive is not None:
+            archive.close()
+        if profiler is not None:
+            print(profiler.summary())
+            profiler.write_chrome_trace(args.profile)
+        if cache is not None:
+            cache.put(key, history)
+
+    # data shown on exit screen of GUI version
+    print("Average reward: {:.2f}".format(history.avg_reward))
+    print("Average efficiency: {:.2f}".format(history.avg_efficiency))
+    print("Average contribution H: {:.2f}".format(history.avg_contribution_h))
+    print("Average contribution L: {:.2f}".format(history.avg_contribution_l))
+    print("Total periods: {}".format(len(history)))
+
+    # plot functions also available in GUI version
+    if args.plot is not None:
+        import project_functions  # imports matplotlib
+
+        if args.plot == "total_payoff":
+            project_functions.diagram1(history.totpaydyn)  # total payoffs
+        elif args.plot == "individual_payoffs":
+            project_functions.diagram2(history.indpayH, history.indpayL)  # individual payoffs
+        elif args.plot == "individual_contributions":
+            project_functions.diagram3(history.indcontH, history.indcontL)  # individual contributions
+        elif args.plot == "reward":
+            project_functions.diagram4(history.reward_hist)  # rewards earned by Q learning algorithm
+        else:
+            project_functions.diagram5(history.kindness)  # kindness
+
+
+# widths of confidence intervals given as metric=width
+def parse_ci_width(items):
+    widths = {}
+    for item in items:
+        name, _, width = item.partition("=")
+        if name not in evaluation_metrics or not width:
+            raise SystemExit("--ci-width expects metric=width with metric in {}, got {}".format(
+                ", ".join(evaluation_metrics), item))
+        widths[name] = float(width)
+    return widths
+
+
+def evaluate_batched_command(args):
+    for option, value in [("--archive", args.archive), ("--profile", args.profile), ("--plot", args.plot),
+                          ("--backend torch", args.backend == "torch")]:
+        if value:
+            raise SystemExit("{} is only available for a single episode".format(option))
+
+    cache = None
+    summary = None
+    if args.seed is not None and not args.no_cache:
+        cache = ResultCache(args.cache)
+        key = evaluation_key(args)
+        summary = cache.get(key)
+
+    if summary is None:
+        policy = NumpyPolicy.from_checkpoint(args.checkpoint)  # batches are always played by the NumPy copy
+        summary = evaluate_batched(args.max_t, policy, args.episodes, args.batch_size, seed=args.seed,
+                                   ci_width=args.ci_width, confidence=args.confidence, min_episodes=args.min_episodes)
+        if cache is not None:
+            cache.put(key, summary)
+
+    # data shown on exit screen of GUI version, averaged over episodes
+    print("{} episodes, means with {:.0%} bootstrap confidence intervals".format(
+        summary["episodes"], summary["confidence"]))
+    for name, label in zip(evaluation_metrics, ["Average reward", "Average efficiency", "Average contribution H",
+                                                 "Average contribution L", "Total periods"]):
+        low, high = summary["ci"][name]
+        print("{}: {:.2f} [{:.2f}, {:.2f}]".format(label, summary["mean"][name], low, high))
+
+
+def bench_command(args):
+    print(device)
+
+    # batched training must compute the same loss as serial training, otherwise its speed is meaningless
+    torch.manual_seed(0)
+    policy, _ = create_policy(args.h_size, nn_hyperparameters["lr"])
+    log_prob_difference, loss_difference = check_batch_loss(policy, max_t=args.max_t)
+    print("batched vs serial loss: log probabilities differ by {:.1e}, loss by {:.1e}".format(
+        log_prob_difference, loss_difference))
+    if log_prob_difference > 1e-5 or loss_difference > 1e-3:
+        raise SystemExit("batched loss does not match serial loss")
+
+    for mode in args.modes:
+        torch.manual_seed(0)
+        policy, optimizer = create_policy(args.h_size, nn_hyperparameters["lr"])
+        print_every = args.episodes + 1  # no feedback about learning progress
+
+        start = time.perf_counter()
+        if mode == "serial":
+            reinforce(policy, optimizer, args.episodes, args.max_t, nn_hyperparameters["gamma"], print_every, seed=0)
+        elif mode == "batched":
+            reinforce_batched(policy, optimizer, args.episodes, args.max_t, nn_hyperparameters["gamma"], print_every,
+                              args.batch_size, seed=0)
+        else:
+            reinforce_parallel(policy, optimizer, args.episodes, args.max_t, nn_hyperparameters["gamma"],
+                               print_every, args.workers, args.batch_size, seed=0)
+        elapsed = time.perf_counter() - start
+
+        print("{}\t{:.1f} episodes/s".format(mode, args.episodes / elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train and evaluate a neural network playing the allocation game")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="train a policy and save it as checkpoint")
+    train_parser.add_argument("--mode", choices=["serial", "batched", "parallel"], default="serial")
+    train_parser.add_argument("--episodes", type=int, default=nn_hyperparameters["n_training_episodes"])
+    train_parser.add_argument("--h-size", type=int, default=nn_hyperparameters["h_size"])
+    train_parser.add_argument("--lr", type=float, default=nn_hyperparameters["lr"])
+    train_parser.add_argument("--gamma", type=float, default=nn_hyperparameters["gamma"])
+    train_parser.add_argument("--max-t", type=int, default=nn_hyperparameters["max_t"])
+    train_parser.add_argument("--batch-size", type=int, default=nn_hyperparameters["batch_size"])
+    train_parser.add_argument("--workers", type=int, default=nn_hyperparameters["n_workers"])
+    train_parser.add_argument("--broadcast-every", type=int, default=nn_hyperparameters["broadcast_every"])
+    train_parser.add_argument("--print-every", type=int, default=100)
+    train_parser.add_argument("--seed", type=int, default=None, help="random seed (parallel mode: 0 if not given)")
+    train_parser.add_argument("--init", default=None, help="checkpoint to continue training from")
+    train_parser.add_argument("--checkpoint", default="deepRL_vs_ag.pt", help="file to save trained model")
+    train_parser.add_argument("--archive", default=None, help="directory to archive all played periods")
+    train_parser.add_argument("--checkpoint-every", type=int, default=0,
+                              help="save a resumable checkpoint every n episodes (in the background)")
+    train_parser.add_argument("--resume", action="store_true",
+                              help="continue training from the resumable checkpoint")
+    train_parser.add_argument("--profile", default=None,
+                              help="time phases of training, print summary and write Chrome trace to this file")
+    train_parser.set_defaults(func=train_command)
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="play games with a saved policy")
+    evaluate_parser.add_argument("--checkpoint", default=default_checkpoint)
+    evaluate_parser.add_argument("--h-size", type=int, default=nn_hyperparameters["h_size"])
+    evaluate_parser.add_argument("--max-t", type=int, default=nn_hyperparameters["max_t"])
+    evaluate_parser.add_argument("--seed", type=int, default=None)
+    evaluate_parser.add_argument("--backend", choices=["numpy", "torch"], default="numpy",
+                                 help="network used to play a single episode (same weights, batches use numpy)")
+    evaluate_parser.add_argument("--archive", default=None, help="directory to archive all played periods")
+    evaluate_parser.add_argument("--profile", default=None,
+                                 help="time phases of the game, print summary and write Chrome trace to this file")
+    evaluate_parser.add_argument("--episodes", type=int, default=1,
+                                 help="games to play, more than one are played in batches and summarized")
+    evaluate_parser.add_argument("--batch-size", type=int, default=100, help="games played at once (with --episodes)")
+    evaluate_parser.add_argument("--ci-width", nargs="+", default=None, metavar="METRIC=WIDTH",
+                                 help="stop once these confidence intervals are narrower, e.g. avg_efficiency=0.02")
+    evaluate_parser.add_argument("--confidence", type=float, default=0.95, help="level of confidence intervals")
+    evaluate_parser.add_argument("--min-episodes", type=int, default=20,
+                                 help="games played before --ci-width can stop the evaluation")
+    evaluate_parser.add_argument("--cache", default=default_directory, help="directory of cached games (with --seed)")
+    evaluate_parser.add_argument("--no-cache", action="store_true", help="play the game even if it is cached")
+    evaluate_parser.add_argument(
+        "--plot",
+        choices=["total_payoff", "individual_payoffs", "individual_contributions", "reward", "kindness"],
+        default=None,
+    )
+    evaluate_parser.set_defaults(func=evaluate_command)
+
+    bench_parser = subparsers.add_parser("bench", help="measure training throughput")
+    bench_parser.add_argument("--modes", nargs="+", choices=["serial", "batched", "parallel"],
+                              default=["serial", "batched", "parallel"])
+    bench_parser.add_argument("--episodes", type=int, default=256)
+    bench_parser.add_argument("--h-size", type=int, default=nn_hyperparameters["h_size"])
+    bench_parser.add_argument("--max-t", type=int, default=nn_hyperparameters["max_t"])
+    bench_parser.add_argument("--batch-size", type=int, default=nn_hyperparameters["batch_size"])
+    bench_parser.add_argument("--workers", type=int, default=nn_hyperparameters["n_workers"])
+    bench_parser.set_defaults(func=bench_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+"""
+    Allocation Problem - Headless server hosting many games for participants connecting over HTTP
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+# import game environment
+from allocation_game import AllocationGame, snapshot_dtype
+
+# import recorder for game history
+from trajectory import TrajectoryRecorder, trajectory_dtype
+
+# settings of the games played by participants, same as in the GUI version
+default_game_settings = {"max_periods": 200}
+
+"""Session: one participant's game, same steps as the GUI version (main.App)"""
+
+
+class Session:
+    def __init__(self, game_settings=None):
+        self.ag = AllocationGame(**(game_settings or default_game_settings))
+        self.ag.reset()
+        self.history = TrajectoryRecorder(self.ag.max_periods, self.ag.max_total_payoff)
+        self.last_used = time.monotonic()
+
+    # parameters shown to the participant at the start
+    def info(self):
+        return {
+            "max_hours": self.ag.max_hours,
+            "hours_step": self.ag.hours_step,
+            "max_periods": self.ag.max_periods,
+            "period": self.ag.period,
+        }
+
+    # binary form for eviction to disk: numbers of actions and periods (.npy format), then the raw bytes of the
+    # game's snapshot, of the recorded periods and of the running averages
+    def save(self, file):
+        history = self.history
+        np.save(file, np.array([self.ag.n_actions, len(history)]))
+        file.write(self.ag.snapshot().tobytes())
+        file.write(history.data[:len(history)].tobytes())
+        file.write(np.array([
+            history.avg_reward, history.avg_efficiency, history.avg_contribution_h, history.avg_contribution_l
+        ]).tobytes())
+
+    @classmethod
+    def load(cls, file):
+        n_actions, length = np.load(file).tolist()
+        dtype = snapshot_dtype(n_actions)
+        snapshot = np.frombuffer(file.read(dtype.itemsize), dtype=dtype)[0]
+        periods = np.frombuffer(file.read(length * trajectory_dtype.itemsize), dtype=trajectory_dtype)
+        averages = np.frombuffer(file.read(4 * 8), dtype=np.float64).tolist()
+
+        session = cls.__new__(cls)
+        session.ag = AllocationGame.from_snapshot(snapshot)
+        session.history = history = TrajectoryRecorder(max(session.ag.max_periods, length), session.ag.max_total_payoff)
+        history.data[:length] = periods
+        history.length = length
+        history.avg_reward, history.avg_efficiency, history.avg_contribution_h, history.avg_contribution_l = averages
+
+        session.last_used = time.monotonic()
+        return session
+
+    # same as App.reset_program
+    def reset_program(self):
+        self.ag.reset()
+        self.history.reset()
+        return self.info()
+
+    # same as App.next_step, hours: user's contribution as entered in the GUI
+    def next_step(self, hours):
+        payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r, count, period, done = self.ag.calculate(
+            hours / self.ag.hours_step
+        )
+        self.history.append(payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r)
+
+        # output to user
+        output = {
+            "period": int(period),
+            "counter": int(count),
+            "payoff_h": int(payoff_h),
+            "payoff_l": int(payoff_l),
+            "hours_l": int(contribution_l),
+            "done": done,
+        }
+
+        # data shown on exit window
+        if done:
+            output["summary"] = {
+                "greed": round(self.ag.a, 2),
+                "envy": round(self.ag.b, 2),
+                "avg_reward": round(self.history.avg_reward, 2),
+                "avg_efficiency": round(self.history.avg_efficiency, 2),
+                "avg_contribution_h": round(self.history.avg_contribution_h, 2),
+                "avg_contribution_l": round(self.history.avg_contribution_l, 2),
+                "periods": int(period),
+            }
+        return output
+
+
+"""Pool of sessions: at most capacity sessions in memory, least recently used ones are moved to disk"""
+
+
+class SessionPool:
+    def __init__(self, directory, capacity=1000, game_settings=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.capacity = capacity
+        self.game_settings = game_settings
+        self.sessions = OrderedDict()  # session id: Session, least recently used first
+
+        # counters for /stats
+        self.evictions = 0
+        self.restores = 0
+
+    def path(self, session_id):
+        return os.path.join(self.directory, session_id + ".session")
+
+    def create(self):
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = Session(self.game_settings)
+        self.shrink(self.capacity)
+        return session_id, self.sessions[session_id]
+
+    # session from memory, or from disk if it was evicted; None if unknown
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.restore(session_id)
+            if session is None:
+                return None
+            self.sessions[session_id] = session
+            self.shrink(self.capacity)
+        else:
+            self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    def delete(self, session_id):
+        found = self.sessions.pop(session_id, None) is not None
+        if os.path.exists(self.path(session_id)):
+            os.remove(self.path(session_id))
+            found = True
+        return found
+
+    # write session to disk (replaced atomically) and remove it from memory
+    def evict(self, session_id):
+        session = self.sessions.pop(session_id)
+        temporary = self.path(session_id) + ".tmp"
+        with open(temporary, "wb") as file:
+            session.save(file)
+        os.replace(temporary, self.path(session_id))
+        self.evictions += 1
+
+    def restore(self, session_id):
+        if not all(c in "0123456789abcdef" for c in session_id) or not os.path.exists(self.path(session_id)):
+            return None
+        with open(self.path(session_id), "rb") as file:
+            session = Session.load(file)
+        os.remove(self.path(session_id))
+        self.restores += 1
+        return session
+
+    # evict least recently used sessions until at most size sessions are in memory
+    def shrink(self, size):
+        while len(self.sessions) > size:
+            self.evict(next(iter(self.sessions)))
+
+    # evict sessions not used for idle_seconds (least recently used first, so the scan stops at the first active one)
+    def evict_idle(self, idle_seconds):
+        deadline = time.monotonic() - idle_seconds
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_used > deadline:
+                break
+            self.evict(session_id)
+
+    def stats(self):
+        return {
+            "in_memory": len(self.sessions),
+            "on_disk": sum(1 for name in os.listdir(self.directory) if name.endswith(".session")),
+            "capacity": self.capacity,
+            "evictions": self.evictions,
+            "restores": self.restores,
+        }
+
+    # move all sessions to disk, e.g. before the server stops
+    def close(self):
+        self.shrink(0)
+
+
+"""HTTP/JSON interface (HTTP/1.1 with keep-alive, only what the API needs)
+
+    POST   /sessions               create a game, returns {"session": id, ...}
+    POST   /sessions/<id>/step     body {"hours": 4}, same output as the GUI
+    POST   /sessions/<id>/reset    start the game again
+    DELETE /sessions/<id>          end the session
+    GET    /stats                  sessions in memory and on disk
+"""
+
+reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class GameServer:
+    def __init__(self, pool, idle_seconds=300):
+        self.pool = pool
+        self.idle_seconds = idle_seconds  # sessions idle for longer are moved to disk
+        self.requests = 0
+
+    # answer to one request: (status, JSON object)
+    def handle(self, method, path, body):
+        parts = [part for part in path.split("?")[0].split("/") if part]
+
+        if parts == ["stats"] and method == "GET":
+            return 200, dict(self.pool.stats(), requests=self.requests)
+        if parts == ["sessions"] and method == "POST":
+            session_id, session = self.pool.create()
+            return 200, dict(session.info(), session=session_id)
+        if len(parts) < 2 or parts[0] != "sessions":
+            return 404, {"error": "unknown path {}".format(path)}
+
+        session_id = parts[1]
+        if len(parts) == 2 and method == "DELETE":
+            if not self.pool.delete(session_id):
+                return 404, {"error": "unknown session"}
+            return 200, {"session": session_id}
+
+        session = self.pool.get(session_id)
+        if session is None:
+            return 404, {"error": "unknown session"}
+        if len(parts) == 3 and parts[2] == "step" and method == "POST":
+            try:
+                hours = float(json.loads(body or b"{}")["hours"])
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": "body must be JSON with a number of hours, e.g. {\"hours\": 4}"}
+            if hours not in session.ag.hours:
+                return 400, {"error": "hours must be one of {}".format(session.ag.hours)}
+            return 200, session.next_step(hours)
+        if len(parts) == 3 and parts[2] == "reset" and method == "POST":
+            return 200, session.reset_program()
+        if len(parts) == 2 and method == "GET":
+            return 200, session.info()
+        return 405, {"error": "{} not allowed on {}".format(method, path)}
+
+    # one connection, several requests if the client keeps it alive
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                self.requests += 1
+                try:
+                    status, answer = self.handle(method, path, body)
+                except Exception as error:  # keep serving other sessions
+                    status, answer = 500, {"error": repr(error)}
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                payload = json.dumps(answer).encode()
+                writer.write(
+                    "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n"
+                    .format(status, reasons[status], len(payload), "keep-alive" if keep_alive else "close")
+                    .encode("latin-1") + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # client went away or sent something that is not HTTP
+        finally:
+            writer.close()
+
+    async def evict_idle_sessions(self):
+        while True:
+            await asyncio.sleep(max(self.idle_seconds / 10, 0.1))
+            self.pool.evict_idle(self.idle_seconds)
+
+    async def start(self, host="127.0.0.1", port=8000):
+        self.server = await asyncio.start_server(self.serve_connection, host, port)
+        self.evictor = asyncio.ensure_future(self.evict_idle_sessions())
+        return self.server.sockets[0].getsockname()[1]  # actual port if port was 0
+
+    async def stop(self):
+        self.evictor.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        self.pool.close()
+
+
+"""Load test: many simulated participants playing at the same time against a server on this machine"""
+
+
+class Client:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, answer=None):
+        payload = b"" if answer is None else json.dumps(answer).encode()
+        self.writer.write(
+            "{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n"
+            .format(method, path, self.host, len(payload)).encode("latin-1") + payload
+        )
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+# one participant: creates a session, plays n_steps periods (starting again after each game), returns latencies
+async def participant(host, port, n_steps, seed, think_time=0.0):
+    rng = np.random.default_rng(seed)
+    client = Client(host, port)
+    await client.connect()
+    latencies = []
+
+    start = time.perf_counter()
+    _, session = await client.request("POST", "/sessions")
+    latencies.append(time.perf_counter() - start)
+    path = "/sessions/{}".format(session["session"])
+
+    for hours in (rng.integers(0, session["max_hours"] // session["hours_step"] + 1, n_steps)
+                  * session["hours_step"]).tolist():
+        if think_time > 0:
+            await asyncio.sleep(rng.exponential(think_time))
+        start = time.perf_counter()
+        status, output = await client.request("POST", path + "/step", {"hours": hours})
+        if output.get("done"):
+            await client.request("POST", path + "/reset")
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            raise RuntimeError("step failed: {}".format(output))
+
+    await client.close()
+    return latencies
+
+
+async def load_test(host, port, n_clients, n_steps, think_time=0.0):
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        participant(host, port, n_steps, seed, think_time) for seed in range(n_clients)
+    ])
+    elapsed = time.perf_counter() - start
+
+    latencies = np.concatenate(results) * 1e3
+    print("{} clients, {} requests in {:.2f} s: {:.0f} requests/s".format(
+        n_clients, len(latencies), elapsed, len(latencies) / elapsed))
+    print("latency ms: p50 {:.2f}, p95 {:.2f}, p99 {:.2f}, max {:.2f}".format(
+        *np.percentile(latencies, [50, 95, 99, 100])))
+
+    stats_client = Client(host, port)
+    await stats_client.connect()
+    _, stats = await stats_client.request("GET", "/stats")
+    await stats_client.close()
+    print("server: {}".format(stats))
+
+
+async def serve(args):
+    server = GameServer(SessionPool(args.directory, args.capacity), args.idle_seconds)
+    port = await server.start(args.host, args.port)
+    print("serving on http://{}:{}".format(args.host, port))
+    try:
+        await asyncio.Event().wait()  # until interrupted
+    finally:
+        await server.stop()
+
+
+async def run_load_test(args):
+    server = None
+    port = args.port
+    if args.start_server:  # server in the same process, e.g. for a quick test
+        server = GameServer(SessionPool(args.directory, args.capacity), args.idle_seconds)
+        port = await server.start(args.host, 0)
+
+    try:
+        await load_test(args.host, port, args.clients, args.steps, args.think_time)
+    finally:
+        if server is not None:
+            await server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless server for many simultaneous allocation games")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, help_text in [("serve", "run the server"), ("load-test", "simulate participants on this machine")]:
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("--host", default="127.0.0.1")
+        subparser.add_argument("--port", type=int, default=8000)
+        subparser.add_argument("--directory", default="sessions", help="directory for evicted sessions")
+        subparser.add_argument("--capacity", type=int, default=1000, help="sessions kept in memory")
+        subparser.add_argument("--idle-seconds", type=float, default=300,
+                               help="sessions idle for longer are moved to disk")
+
+    load_test_parser = subparsers.choices["load-test"]
+    load_test_parser.add_argument("--clients", type=int, default=200)
+    load_test_parser.add_argument("--steps", type=int, default=100, help="periods played by each client")
+    load_test_parser.add_argument("--think-time", type=float, default=0.0, help="mean seconds between inputs")
+    load_test_parser.add_argument("--start-server", action="store_true", help="start a server in this process")
+
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args) if args.command == "serve" else run_load_test(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
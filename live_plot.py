@@ -0,0 +1,173 @@
+"""
+    Allocation Problem - Auxiliary file with live plot embedded in GUI
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import numpy as np
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+# plots of the History menu: y label and (column of game history, color, label) for each line, cf. project_functions
+diagrams = {
+    "total_payoff": ("Total payoff", [("totpaydyn", None, None)]),
+    "individual_payoffs": ("Individual payoff", [
+        ("indpayH", "r", "Payoff Player H"),
+        ("indpayL", "b", "Payoff Player L"),
+    ]),
+    "individual_contributions": ("Individual contribution", [
+        ("indcontH", "r", "Contribution Player H"),
+        ("indcontL", "b", "Contribution Player L"),
+    ]),
+    "reward": ("Reward Player L", [("reward_hist", None, None)]),
+    "kindness": ("Kindness", [("kindness", None, None)]),
+}
+
+
+"""Downsampling of long histories: minimum and maximum of buckets of periods, buckets double in size when full"""
+
+
+class MinMaxDecimator:
+    def __init__(self, max_buckets=150):
+        self.max_buckets = max_buckets
+        self.reset()
+
+    def reset(self):
+        self.bucket_size = 1  # periods per bucket
+        self.starts = []  # first period of each bucket
+        self.mins = []
+        self.maxs = []
+        self.n = 0  # number of periods seen
+
+    def append(self, value):
+        if not self.starts or self.n - self.starts[-1] >= self.bucket_size:  # last bucket is full
+            self.starts.append(self.n)
+            self.mins.append(value)
+            self.maxs.append(value)
+        else:
+            self.mins[-1] = min(self.mins[-1], value)
+            self.maxs[-1] = max(self.maxs[-1], value)
+        self.n += 1
+
+        # too many buckets: merge neighbours, cost is spread over the next max_buckets / 2 periods
+        if len(self.starts) > self.max_buckets:
+            self.starts = self.starts[::2]
+            self.mins = [min(self.mins[i:i + 2]) for i in range(0, len(self.mins), 2)]
+            self.maxs = [max(self.maxs[i:i + 2]) for i in range(0, len(self.maxs), 2)]
+            self.bucket_size *= 2
+
+    # points to draw: every period as long as possible, otherwise minimum and maximum of each bucket
+    def points(self):
+        if self.bucket_size == 1:
+            return np.array(self.starts), np.array(self.mins)
+        x = np.repeat(self.starts, 2) + np.tile([0, self.bucket_size / 2], len(self.starts))
+        y = np.column_stack([self.mins, self.maxs]).ravel()
+        return x, y
+
+
+"""Plot panel: lines are extended with every new period and redrawn by blitting"""
+
+
+class LivePlotPanel:
+    def __init__(self, master, history, diagram="individual_contributions", max_buckets=150):
+        self.history = history  # TrajectoryRecorder of the game
+        self.max_buckets = max_buckets
+        self.seen = 0  # number of periods already added to the plot
+
+        self.figure = Figure(figsize=(4.4, 3.2), dpi=100)
+        self.ax = self.figure.add_subplot()
+        self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.widget = self.canvas.get_tk_widget()
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+
+        self.show(diagram)
+
+    # switch to one of the diagrams of the History menu
+    def show(self, diagram):
+        ylabel, series = diagrams[diagram]
+        self.ax.clear()
+        self.ax.set_xlabel("Period")
+        self.ax.set_ylabel(ylabel)
+
+        self.columns = []
+        self.decimators = []
+        self.lines = []
+        for column, color, label in series:
+            line, = self.ax.plot([], [], color=color, label=label, animated=True, solid_joinstyle="bevel")
+            self.columns.append(column)
+            self.decimators.append(MinMaxDecimator(self.max_buckets))
+            self.lines.append(line)
+        if series[0][2] is not None:
+            self.ax.legend(handles=self.lines, loc="upper left")
+
+        self.seen = 0
+        self.ymin, self.ymax = np.inf, -np.inf  # range of all values shown
+        self.ax.set_xlim(0, 10)
+        self.ax.set_ylim(0, 1)
+        self.update(redraw=True)
+
+    # start again with an empty game history
+    def clear(self):
+        self.seen = 0
+        self.ymin, self.ymax = np.inf, -np.inf
+        for decimator in self.decimators:
+            decimator.reset()
+        self.ax.set_xlim(0, 10)
+        self.update(redraw=True)
+
+    # add periods recorded since last call and draw them
+    def update(self, redraw=False):
+        n = len(self.history)
+        if n > self.seen:
+            for column, decimator in zip(self.columns, self.decimators):
+                values = self.history.column(column)[self.seen:n]
+                for value in values.tolist():
+                    decimator.append(value)
+                self.ymin = min(self.ymin, values.min())
+                self.ymax = max(self.ymax, values.max())
+            self.seen = n
+
+        for line, decimator in zip(self.lines, self.decimators):
+            line.set_data(*decimator.points())
+
+        # axes only change if lines leave them, x axis grows in steps of doubling
+        xmax = self.ax.get_xlim()[1]
+        if n > xmax:
+            self.ax.set_xlim(0, max(2 * xmax, n))
+            redraw = True
+        ylow, yhigh = self.ax.get_ylim()
+        if self.seen > 0 and (self.ymin < ylow or self.ymax > yhigh):
+            margin = max(0.1 * (self.ymax - self.ymin), 1)
+            self.ax.set_ylim(self.ymin - margin, self.ymax + margin)
+            redraw = True
+
+        if redraw or self.background is None:
+            self.canvas.draw()  # full redraw, calls on_draw
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_lines()
+
+    # store everything but the lines whenever the full figure is drawn (also after resizing the window)
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_lines()
+
+    def draw_lines(self):
+        for line in self.lines:
+            self.ax.draw_artist(line)
+        self.canvas.blit(self.figure.bbox)
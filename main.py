@@ -17,26 +17,31 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
 
+import argparse
+import time
 import tkinter as tk
 from tkinter import ttk, N, W, S, E, StringVar
 
-import numpy as np
-
 # import game environment
 from allocation_game import AllocationGame
 
+# import recorder for game history (its live plot and matplotlib are imported on first use)
+from trajectory import TrajectoryRecorder
+
 # import menu bar
 from appmenu import MenuBar
 
-# initialize game
-ag = AllocationGame(max_periods=200)
-ag.reset()
+start_time = time.perf_counter()  # reference for startup time, heavy imports (matplotlib) only follow on first use
 
 
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
 
+        # initialize game
+        self.ag = AllocationGame(max_periods=200)
+        self.ag.reset()
+
         "main window"
 
         # menu
@@ -67,8 +72,8 @@ class App(tk.Tk):
         ttk.Spinbox(
             mainframe,
             from_=0,
-            to=10,
-            increment=2,
+            to=self.ag.max_hours,
+            increment=self.ag.hours_step,
             textvariable=self.qH
         ).grid(column=1, row=1, sticky=tk.W)
 
@@ -92,27 +97,24 @@ class App(tk.Tk):
         ttk.Button(
             mainframe,
             text="Calculate",
-            command=lambda: self.next_step(float(self.qH.get())/2)  # ag input requires int between 0 and 5
+            command=lambda: self.next_step(float(self.qH.get())/self.ag.hours_step)  # ag input: action on grid
         ).grid(column=1, row=5, sticky=tk.W, padx=5, pady=5)
 
         # padding for main window
         for child in mainframe.winfo_children():
             child.grid_configure(padx=5, pady=5)
 
-        # lists for data collection
-        self.totpaydyn = []
-        self.indpayH = []
-        self.indpayL = []
-        self.indcontH = []
-        self.indcontL = []
-        self.kindness = []
-        self.reward_hist = []
+        # data collection
+        self.history = TrajectoryRecorder(self.ag.max_periods, self.ag.max_total_payoff)
+
+        # plot of game history below main window, created when a diagram is first selected in History menu
+        self.plot_panel = None
 
         # output on exit window
         self.greed = StringVar()
-        self.greed.set(round(ag.a, 2))
+        self.greed.set(round(self.ag.a, 2))
         self.envy = StringVar()
-        self.envy.set(round(ag.b, 2))
+        self.envy.set(round(self.ag.b, 2))
         self.avg_reward = StringVar()
         self.avg_efficiency = StringVar()
         self.periodstr = StringVar()
@@ -121,20 +123,15 @@ class App(tk.Tk):
 
     # function to reset game environment and data collected by the app
     def reset_program(self):
-        ag.reset()
-
-        self.totpaydyn = []
-        self.indpayH = []
-        self.indpayL = []
-        self.indcontH = []
-        self.indcontL = []
-        self.kindness = []
-        self.reward_hist = []
+        self.ag.reset()
+        self.history.reset()
+        if self.plot_panel is not None:
+            self.plot_panel.clear()
 
     # function to advance the game one period
     def next_step(self, action):
         # retrieve algorithm's decision
-        payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r, count, period, done = ag.calculate(action)
+        payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r, count, period, done = self.ag.calculate(action)
 
         # prepare output to user
         self.time_step.set(int(period))
@@ -144,25 +141,32 @@ class App(tk.Tk):
         self.counter.set(int(count))
 
         # update payoff histories for plots
-        self.totpaydyn.append(payoff_h + payoff_l)
-        self.indpayL.append(payoff_l)
-        self.indpayH.append(payoff_h)
-        self.indcontL.append(contribution_l)
-        self.indcontH.append(contribution_h)
-        self.reward_hist.append(reward_q)
-        self.kindness.append(r)
+        self.history.append(payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r)
+        if self.plot_panel is not None:
+            self.plot_panel.update()
 
         # what to do when game terminates
         if done:
-            self.avg_reward.set(round(np.sum(self.reward_hist) / len(self.reward_hist), 2))
-            self.avg_efficiency.set(round(np.sum(self.totpaydyn) / (len(self.totpaydyn) * 42), 2))
-            self.avg_contributionH.set(round(np.sum(self.indcontH) / len(self.indcontH), 2))
-            self.avg_contributionL.set(round(np.sum(self.indcontL) / len(self.indcontL), 2))
+            self.avg_reward.set(round(self.history.avg_reward, 2))
+            self.avg_efficiency.set(round(self.history.avg_efficiency, 2))
+            self.avg_contributionH.set(round(self.history.avg_contribution_h, 2))
+            self.avg_contributionL.set(round(self.history.avg_contribution_l, 2))
             self.periodstr.set(period)
             self.exit_window()
         else:
             pass
 
+    # function to show one of the diagrams of the History menu below the main window
+    def show_plot(self, diagram):
+        if self.plot_panel is None:
+            from live_plot import LivePlotPanel  # imports matplotlib
+
+            self.plot_panel = LivePlotPanel(self, self.history, diagram)
+            self.plot_panel.widget.grid(column=0, row=1, columnspan=2, sticky=(N, W, E, S))
+            self.geometry("440x520")
+        else:
+            self.plot_panel.show(diagram)
+
     "info window"
 
     def info(self):
@@ -250,5 +254,20 @@ class App(tk.Tk):
 
 # start app
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Allocation game against a Q learning algorithm")
+    parser.add_argument(
+        "--startup-time",
+        action="store_true",
+        help="print seconds until the window is shown, then exit"
+    )
+    args = parser.parse_args()
+
     app = App()
-    app.mainloop()
+    app.update()  # draw window
+    app.startup_time = time.perf_counter() - start_time
+
+    if args.startup_time:
+        print("{:.3f}".format(app.startup_time))
+        app.destroy()
+    else:
+        app.mainloop()
@@ -0,0 +1,303 @@
+"""
+    Allocation Problem - Auxiliary file to propagate expected learning dynamics of the Q learning algorithm
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from allocation_game import contribution_grid, max_total_payoff, payoff_table
+from vec_allocation_game import VecAllocationGame
+
+# mean trajectories, one value per period (averages over games that play the period)
+trajectory_names = ["survival", "termination", "efficiency", "contribution_h", "contribution_l", "reward_q", "r",
+                    "q_mean"]
+
+"""User strategies: probabilities of the user's actions, shape (n, n_actions)
+
+    Inputs are arrays of length n of the user's and the agent's previous actions and the agent's kindness.
+"""
+
+
+# mixed strategy of a trained network (Policy or NumpyPolicy), inputs as in deepRL_vs_ag
+def policy_strategy(policy, player_type="low", max_hours=10, hours_step=2):
+    from numpy_policy import NumpyPolicy
+
+    if not isinstance(policy, NumpyPolicy):
+        policy = NumpyPolicy(policy.state_dict())
+    scale = max_hours / 2
+
+    def strategy(user_old, agent_old, r):
+        user_hours = np.asarray(user_old) * hours_step
+        agent_hours = np.asarray(agent_old) * hours_step
+        if player_type == "low":  # user is player H
+            contribution_h, contribution_l = user_hours, agent_hours
+        else:
+            contribution_h, contribution_l = agent_hours, user_hours
+        return policy.probs(np.stack([contribution_h / scale - 0.5, contribution_l / scale - 0.5, r], axis=1))
+
+    return strategy
+
+
+# same mixed strategy in every state, e.g. uniform
+def fixed_strategy(probs):
+    probs = np.asarray(probs, dtype=float) / np.sum(probs)
+    return lambda user_old, agent_old, r: np.broadcast_to(probs, (len(user_old), len(probs)))
+
+
+"""Setup for expected dynamics: instead of sampling games, each period propagates the distribution of the previous
+actions and the repetition counter (which decides termination), together with the mean Q values and mean kindness.
+The agent is epsilon greedy on the mean Q values and the user's strategy sees the mean kindness; everything else is
+exact. The approximation ignores how much Q values differ between games, e.g. games locking into different greedy
+actions in the same state (validate measures the resulting error)."""
+
+
+class MeanFieldGame:
+    def __init__(self,
+                 alpha0=0.05,
+                 decay=0.005,
+                 gamma_q=0.9,
+                 exploration_periods=100,
+                 max_periods=1000,
+                 sensitivity=0.1,
+                 player_type="low",
+                 max_hours=10,
+                 hours_step=2,
+                 threshold=8,
+                 bonus=25,
+                 cost_h=3,
+                 cost_l=1,
+                 a=None,
+                 b=None):
+        self.player_type = player_type
+        self.max_hours = max_hours
+        self.hours_step = hours_step
+        self.hours = np.array(contribution_grid(max_hours, hours_step))
+        self.n_actions = len(self.hours)
+
+        # payoff tables indexed by [agent's action, user's action], as in VecAllocationGame
+        rewards_l = payoff_table(self.hours, threshold, bonus, cost_l)
+        rewards_h = payoff_table(self.hours, threshold, bonus, cost_h)
+        self.max_total_payoff = max_total_payoff(rewards_l, rewards_h)
+        rewards_l = np.array(rewards_l)
+        rewards_h = np.array(rewards_h)
+        if player_type == "low":
+            self.own_payoffs, self.other_payoffs = rewards_l, rewards_h.T
+        else:
+            self.own_payoffs, self.other_payoffs = rewards_h, rewards_l.T
+
+        # hyperparameters
+        self.alpha0 = alpha0
+        self.decay = decay
+        self.gamma_q = gamma_q
+        self.exploration_periods = exploration_periods
+        self.max_periods = max_periods
+        self.sensitivity = sensitivity
+
+        # preference parameters: fixed, or the mean of their uniform draw (utility is linear in them)
+        self.a = 0.5 if a is None else a
+        self.b = 0.5 if b is None else b
+
+        # state after the user's action, as in calculate (int(action / hours_step))
+        self.next_states = (np.arange(self.n_actions) / hours_step).astype(int)
+
+    # expected trajectories against strategy for all periods, dict of arrays (see trajectory_names) and final mean Q
+    def run(self, strategy):
+        n = self.n_actions
+        states = np.arange(n)
+        user_old, agent_old = np.meshgrid(states, states, indexing="ij")
+        user_old = user_old.ravel()
+        agent_old = agent_old.ravel()
+
+        kind = self.own_payoffs >= self.other_payoffs  # [agent's action, user's action]
+        total_payoffs = (self.own_payoffs + self.other_payoffs).T  # [user's action, agent's action]
+        if self.player_type == "low":
+            hours_h, hours_l = np.meshgrid(self.hours, self.hours, indexing="ij")  # [user's action, agent's action]
+        else:
+            hours_l, hours_h = np.meshgrid(self.hours, self.hours, indexing="ij")
+
+        # probability of running games by previous actions [user, agent] and repetition counter 0, ..., 4
+        mass = np.zeros((n, n, 5))
+        mass[0, 0, 0] = 1.0
+        Q = np.zeros((n, n))  # mean Q values [state (user's previous action), agent's action]
+        r = 0.0
+
+        trajectories = {name: np.zeros(self.max_periods) for name in trajectory_names}
+        for period in range(self.max_periods):
+            alive = mass.sum()
+            if alive < 1e-12:
+                break
+            epsilon = max(1 - period / self.exploration_periods, 0.01)
+            alpha = self.alpha0 / (1 + period * self.decay)
+
+            # agent: epsilon greedy on mean Q values [state, action]; user: strategy [user old, agent old, action]
+            agent_probs = np.full((n, n), epsilon / n)
+            agent_probs[states, Q.argmax(axis=1)] += 1 - epsilon
+            user_probs = strategy(user_old, agent_old, np.full(n * n, r)).reshape(n, n, n)
+
+            # joint probability [user old, agent old, counter, user's action, agent's action] of running games
+            joint = (mass[:, :, :, None, None] * user_probs[:, :, None, :, None]
+                     * agent_probs[:, None, None, None, :]) / alive
+            actions = joint.sum(axis=(0, 1, 2))  # [user's action, agent's action]
+
+            # expected utility of the agent (Charness & Rabin, 2002, QJE), with kindness before its update
+            own = self.own_payoffs.T
+            other = self.other_payoffs.T
+            rewards = np.where(kind.T, self.a * own + r * (1 - self.a) * other, self.b * own + r * (1 - self.b) * other)
+
+            trajectories["survival"][period] = alive
+            trajectories["efficiency"][period] = (actions * total_payoffs).sum() / self.max_total_payoff
+            trajectories["contribution_h"][period] = (actions * hours_h).sum()
+            trajectories["contribution_l"][period] = (actions * hours_l).sum()
+            trajectories["reward_q"][period] = (actions * rewards).sum()
+
+            # expected Q update: each game moves the value of its state and action towards its target
+            targets = rewards + self.gamma_q * Q.max(axis=1)[self.next_states][:, None]  # [user's action, agent's]
+            visits = joint.sum(axis=(1, 2))  # [state, user's action, agent's action]
+            Q += alpha * ((visits * targets[None]).sum(axis=1) - visits.sum(axis=1) * Q)
+
+            # kindness drift
+            r += self.sensitivity * (2 * (actions * kind.T).sum() - 1)
+            trajectories["r"][period] = r
+            trajectories["q_mean"][period] = Q.mean()
+
+            # repetition counters: same actions as before count up, games reaching 5 repetitions end
+            joint *= alive
+            repeated = np.einsum("ijkij->ijk", joint)  # [user old, agent old, counter]
+            mass = np.zeros((n, n, 5))
+            mass[:, :, 0] = joint.sum(axis=(0, 1, 2)) - repeated.sum(axis=2)
+            mass[:, :, 1:] = repeated[:, :, :4]
+            trajectories["termination"][period] = repeated[:, :, 4].sum()
+        trajectories["termination"][self.max_periods - 1] += mass.sum()  # games at maximum length end
+
+        return trajectories, Q
+
+
+# same trajectories as MeanFieldGame.run, averaged over n_games sampled games (a and b fixed if given)
+def sample_runs(strategy, n_games, game_settings, a=None, b=None, seed=None):
+    rng = np.random.default_rng(seed)
+    vag = VecAllocationGame(n_games, seed=rng.integers(2 ** 63), **game_settings)
+    if a is not None:
+        vag.a[:] = a
+    if b is not None:
+        vag.b[:] = b
+
+    trajectories = {name: np.zeros(vag.max_periods) for name in trajectory_names}
+    trajectories["q_mean"][:] = np.nan  # not known in the last period (finished games are reset)
+    active = np.ones(n_games, dtype=bool)
+    for period in range(vag.max_periods):
+        if vag.player_type == "low":
+            user_old, agent_old = vag.contribution_h_old, vag.contribution_l_old
+        else:
+            user_old, agent_old = vag.contribution_l_old, vag.contribution_h_old
+        cdf = np.cumsum(strategy((user_old / vag.hours_step).astype(int), (agent_old / vag.hours_step).astype(int),
+                                 vag.r), axis=1)
+        actions = np.minimum((rng.random((n_games, 1)) * cdf[:, -1:] >= cdf).sum(axis=1), vag.n_actions - 1)
+
+        payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r, count, _, done = vag.step(actions)
+
+        trajectories["survival"][period] = active.mean()
+        trajectories["termination"][period] = (active & done).mean()
+        trajectories["efficiency"][period] = ((payoff_h + payoff_l)[active]).mean() / vag.max_total_payoff
+        trajectories["contribution_h"][period] = contribution_h[active].mean()
+        trajectories["contribution_l"][period] = contribution_l[active].mean()
+        trajectories["reward_q"][period] = reward_q[active].mean()
+        trajectories["r"][period] = r[active].mean()
+        if (active & ~done).any():  # finished games were reset by step
+            trajectories["q_mean"][period] = vag.Q_values[active & ~done].mean()
+
+        active &= ~done
+        if not active.any():
+            break
+
+    return trajectories
+
+
+# compare expected and sampled trajectories while at least min_games sampled games run
+# a trajectory passes if its largest difference is at most atol + rtol * scale (largest sampled absolute value)
+# returns True if all trajectories pass, and the largest difference of each trajectory
+def validate(strategy, game_settings, n_games=10000, a=None, b=None, seed=0, min_games=100, rtol=0.25, atol=0.01):
+    start = time.perf_counter()
+    expected, _ = MeanFieldGame(a=a, b=b, **game_settings).run(strategy)
+    mean_field_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sampled = sample_runs(strategy, n_games, game_settings, a, b, seed)
+    sampling_time = time.perf_counter() - start
+
+    periods = sampled["survival"] * n_games >= min_games
+    print("mean field: {:.3f} s, {} sampled games: {:.3f} s".format(mean_field_time, n_games, sampling_time))
+    print("expected periods: {:.1f} (sampled {:.1f})".format(expected["survival"].sum(), sampled["survival"].sum()))
+    print("{:<16}{:>14}{:>14}{:>14}{:>14}{:>14}".format(
+        "trajectory", "max |diff|", "mean |diff|", "at period", "scale", "tolerance"))
+    differences = {}
+    passed = True
+    for name in trajectory_names:
+        compared = periods & ~np.isnan(sampled[name])
+        difference = np.abs(expected[name] - sampled[name])[compared]
+        worst = int(np.argmax(difference))
+        differences[name] = float(difference[worst])
+        scale = np.max(np.abs(sampled[name][compared]))
+        tolerance = atol + rtol * scale
+        passed &= differences[name] <= tolerance
+        print("{:<16}{:>14.4f}{:>14.4f}{:>14}{:>14.4f}{:>14.4f}{}".format(
+            name, difference[worst], difference.mean(), np.flatnonzero(compared)[worst], scale, tolerance,
+            "" if differences[name] <= tolerance else "  FAILED"))
+    return bool(passed), differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expected learning dynamics of the Q learning algorithm")
+    parser.add_argument("--user", choices=["policy", "uniform"], default="policy",
+                        help="trained network (--checkpoint) or uniformly random user")
+    parser.add_argument("--checkpoint", default=None, help="default: included checkpoint")
+    parser.add_argument("--player-type", choices=["low", "high"], default="low")
+    parser.add_argument("--max-periods", type=int, default=200)
+    parser.add_argument("--a", type=float, default=None, help="fixed preference parameter (default: random draws)")
+    parser.add_argument("--b", type=float, default=None)
+    parser.add_argument("--validate", action="store_true", help="compare with sampled games")
+    parser.add_argument("--games", type=int, default=10000, help="sampled games for --validate")
+    parser.add_argument("--rtol", type=float, default=0.25, help="tolerance of --validate relative to the scale")
+    parser.add_argument("--atol", type=float, default=0.01, help="absolute tolerance of --validate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    settings = {"max_periods": args.max_periods, "player_type": args.player_type}
+    game = MeanFieldGame(a=args.a, b=args.b, **settings)
+    if args.user == "uniform":
+        user = fixed_strategy(np.ones(game.n_actions))
+    else:
+        from numpy_policy import NumpyPolicy
+        if args.checkpoint is None:
+            import os
+            args.checkpoint = os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints",
+                                           "deepRL_vs_ag_10000.pt")
+        user = policy_strategy(NumpyPolicy.from_checkpoint(args.checkpoint), args.player_type)
+
+    if args.validate:
+        passed, _ = validate(user, settings, args.games, args.a, args.b, args.seed, rtol=args.rtol, atol=args.atol)
+        if not passed:
+            raise SystemExit("mean field approximation is outside the tolerance")
+    else:
+        trajectories, _ = game.run(user)
+        print("expected periods: {:.1f}".format(trajectories["survival"].sum()))
+        print("{:>8}".format("period") + "".join("{:>16}".format(name) for name in trajectory_names))
+        for period in range(0, args.max_periods, max(1, args.max_periods // 20)):
+            print("{:>8}".format(period) + "".join(
+                "{:>16.4f}".format(trajectories[name][period]) for name in trajectory_names))
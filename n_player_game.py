@@ -0,0 +1,300 @@
+"""
+    Allocation Problem - Auxiliary file with allocation game of N players and sparse Q values
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from allocation_game import contribution_grid
+
+
+"""Q values of visited states only: joint states are integer codes, rows are allocated on first write"""
+
+
+class SparseQTable:
+    def __init__(self, n_actions, capacity=16):
+        self.n_actions = n_actions
+        self.index = {}  # state code: row of values
+        self.values = np.zeros((capacity, n_actions))  # grows by doubling
+        self.row_max = []  # cached maximum of each row
+        self.row_argmax = []  # cached position of each row's maximum (first one, like np.argmax)
+
+    def __len__(self):
+        return len(self.index)
+
+    # row of a state, allocated if the state was never visited
+    def row(self, state):
+        row = self.index.get(state)
+        if row is None:
+            row = len(self.index)
+            if row == len(self.values):
+                self.values = np.concatenate([self.values, np.zeros_like(self.values)])
+            self.index[state] = row
+            self.row_max.append(0.0)
+            self.row_argmax.append(0)
+        return row
+
+    # unvisited states have Q values of zero, reading them allocates nothing
+    def best_action(self, state):
+        row = self.index.get(state)
+        return 0 if row is None else self.row_argmax[row]
+
+    def best_value(self, state):
+        row = self.index.get(state)
+        return 0.0 if row is None else self.row_max[row]
+
+    def value(self, state, action):
+        row = self.index.get(state)
+        return 0.0 if row is None else float(self.values[row, action])
+
+    # write a single Q value and update the cached maximum of its row (cf. AllocationGame.set_q_value)
+    def set_value(self, state, action, value):
+        row = self.row(state)
+        self.values[row, action] = value
+        best = self.row_argmax[row]
+
+        if action == best:
+            if value >= self.row_max[row]:
+                self.row_max[row] = value
+            else:  # maximum decreased, only case in which the row must be searched again
+                best = int(np.argmax(self.values[row]))
+                self.row_argmax[row] = best
+                self.row_max[row] = float(self.values[row, best])
+        elif value > self.row_max[row] or (value == self.row_max[row] and action < best):
+            self.row_argmax[row] = action
+            self.row_max[row] = value
+
+    # forget all states, but keep the memory of the values
+    def clear(self):
+        self.values[:len(self.index)] = 0.0
+        self.index.clear()
+        self.row_max = []
+        self.row_argmax = []
+
+    # bytes used by values, index and caches (approximate for the Python containers)
+    def nbytes(self):
+        keys = sum(sys.getsizeof(state) for state in self.index)
+        caches = sys.getsizeof(self.row_max) + sys.getsizeof(self.row_argmax) + 24 * len(self.index)
+        return self.values.nbytes + sys.getsizeof(self.index) + keys + caches
+
+
+"""Setup for environment: user (player 0) against N - 1 Q learning algorithms observing all previous contributions"""
+
+
+class NPlayerAllocationGame:
+    def __init__(self,
+                 n_players=3,
+                 cost_multipliers=None,
+                 threshold=None,
+                 bonus=25,
+                 alpha0=0.05,
+                 decay=0.005,
+                 gamma_q=0.9,
+                 exploration_periods=100,
+                 max_periods=1000,
+                 sensitivity=0.1,
+                 seed=None,
+                 block_size=1024,
+                 max_hours=10,
+                 hours_step=2):
+        self.n_players = n_players
+
+        # grid of contributions, as in the two player game (0, 2, ..., 10 hours by default)
+        self.hours = contribution_grid(max_hours, hours_step)
+        self.n_actions = len(self.hours)
+        self.max_hours = max_hours
+
+        # costs per hour of each player, default: user like player H, agents like player L of the two player game
+        if cost_multipliers is None:
+            cost_multipliers = [3] + [1] * (n_players - 1)
+        if len(cost_multipliers) != n_players:
+            raise ValueError("need one cost multiplier per player, got {}".format(len(cost_multipliers)))
+        self.cost_multipliers = list(cost_multipliers)
+
+        # bonus is paid to everyone if total hours reach the threshold (8 of 10 hours each for two players)
+        self.threshold = 2 * max_hours * n_players // 5 if threshold is None else threshold
+        self.bonus = bonus
+
+        # hyperparameters
+        self.alpha0 = alpha0  # initial learning rate
+        self.decay = decay  # decay of learning rate
+        self.gamma_q = gamma_q  # discounting factor
+        self.exploration_periods = exploration_periods  # length of exploration phase
+        self.max_periods = max_periods  # maximum length of game
+        self.sensitivity = sensitivity  # increment of changes to kindness
+
+        # one table per agent, states: joint previous actions of all players as number in base n_actions
+        self.tables = [SparseQTable(self.n_actions) for _ in range(n_players - 1)]
+
+        # random numbers of this game: own generator, drawn in blocks of block_size
+        self.rng = np.random.default_rng(seed)
+        self.block_size = block_size
+        self.uniforms = []
+        self.uniform_pos = 0
+        self.random_actions = []
+        self.action_pos = 0
+
+        self.reset()
+
+    # code of a joint action (action of player 0 is the lowest digit)
+    def encode(self, actions):
+        code = 0
+        for action in reversed(actions):
+            code = code * self.n_actions + action
+        return code
+
+    def reset(self):
+        self.count = 0
+        self.actions_old = [0] * self.n_players
+        self.state = 0  # code of actions_old
+        self.period = 0
+
+        # preference parameters and kindness of each agent
+        self.a = self.rng.random(self.n_players - 1).tolist()  # "greed"
+        self.b = self.rng.random(self.n_players - 1).tolist()  # "envy"
+        self.r = [0.0] * (self.n_players - 1)
+
+        for table in self.tables:
+            table.clear()
+
+    def random_uniform(self):
+        if self.uniform_pos == len(self.uniforms):
+            self.uniforms = self.rng.random(self.block_size).tolist()
+            self.uniform_pos = 0
+        self.uniform_pos += 1
+        return self.uniforms[self.uniform_pos - 1]
+
+    def random_action(self):
+        if self.action_pos == len(self.random_actions):
+            self.random_actions = self.rng.integers(0, self.n_actions, self.block_size).tolist()
+            self.action_pos = 0
+        self.action_pos += 1
+        return self.random_actions[self.action_pos - 1]
+
+    # advance the game one period, action: user's action (0, ..., n_actions - 1)
+    # returns lists over players (payoffs, contributions) or agents (rewards, kindness) and counters
+    def calculate(self, action):
+        epsilon = max(1 - self.period / self.exploration_periods, 0.01)  # probability of random choice
+        state = self.state
+
+        # agents' actions, epsilon greedy
+        actions = [action]
+        for table in self.tables:
+            if self.random_uniform() < epsilon:
+                actions.append(self.random_action())
+            else:
+                actions.append(table.best_action(state))
+        next_state = self.encode(actions)
+
+        # update endgame counter
+        if next_state == state:
+            self.count += 1
+        else:
+            self.count = 0
+
+        # payoffs
+        contributions = [self.hours[a] for a in actions]
+        bonus = self.bonus if sum(contributions) >= self.threshold else 0
+        payoffs = [bonus - cost * hours for cost, hours in zip(self.cost_multipliers, contributions)]
+        total_payoff = sum(payoffs)
+
+        # agents' utilities (Charness & Rabin, 2002, against the average of all others) and Q updates
+        alpha = self.alpha0 / (1 + self.period * self.decay)  # learning rate
+        rewards_q = []
+        for agent, table in enumerate(self.tables):
+            own_payoff = payoffs[agent + 1]
+            other_payoff = (total_payoff - own_payoff) / (self.n_players - 1)
+            if own_payoff >= other_payoff:
+                reward_q = self.a[agent] * own_payoff + self.r[agent] * (1 - self.a[agent]) * other_payoff
+                self.r[agent] += self.sensitivity
+            else:
+                reward_q = self.b[agent] * own_payoff + self.r[agent] * (1 - self.b[agent]) * other_payoff
+                self.r[agent] -= self.sensitivity
+            rewards_q.append(reward_q)
+
+            own_action = actions[agent + 1]
+            q_value = table.value(state, own_action) * (1 - alpha)
+            q_value += alpha * (reward_q + self.gamma_q * table.best_value(next_state))
+            table.set_value(state, own_action, q_value)
+
+        # prepare next period
+        self.actions_old = actions
+        self.state = next_state
+        self.period += 1
+
+        done = self.count >= 5 or self.period == self.max_periods
+        return payoffs, contributions, rewards_q, list(self.r), self.count, self.period, done
+
+    # visited states and bytes of all Q tables
+    def q_states(self):
+        return sum(len(table) for table in self.tables)
+
+    def q_nbytes(self):
+        return sum(table.nbytes() for table in self.tables)
+
+
+# memory of dense tables with the same states: one float per joint state and action for each agent
+def dense_nbytes(n_players, n_actions=6):
+    return (n_players - 1) * n_actions ** n_players * n_actions * 8
+
+
+# play games against a random user for each number of players, report memory and speed
+def scaling_report(player_numbers, n_steps, max_periods=1000, seed=0, max_hours=10, hours_step=2):
+    print("{:>8}{:>14}{:>16}{:>14}{:>16}{:>12}".format(
+        "players", "Q states", "dense states", "sparse MB", "dense MB", "steps/s"))
+    for n_players in player_numbers:
+        game = NPlayerAllocationGame(n_players, max_periods=max_periods, seed=seed, max_hours=max_hours,
+                                     hours_step=hours_step)
+        user_actions = np.random.default_rng(seed).integers(0, game.n_actions, n_steps).tolist()
+
+        most_states = 0
+        most_bytes = 0
+        start = time.perf_counter()
+        for action in user_actions:
+            if game.calculate(action)[-1]:
+                most_states = max(most_states, game.q_states())
+                most_bytes = max(most_bytes, game.q_nbytes())
+                game.reset()
+        elapsed = time.perf_counter() - start
+        most_states = max(most_states, game.q_states())
+        most_bytes = max(most_bytes, game.q_nbytes())
+
+        print("{:>8}{:>14}{:>16}{:>14.3f}{:>16.3f}{:>12.0f}".format(
+            n_players,
+            most_states,
+            (n_players - 1) * game.n_actions ** n_players,
+            most_bytes / 1e6,
+            dense_nbytes(n_players, game.n_actions) / 1e6,
+            n_steps / elapsed,
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and speed of the N player allocation game")
+    parser.add_argument("--players", type=int, nargs="+", default=[2, 3, 4, 6, 8, 12])
+    parser.add_argument("--steps", type=int, default=20000)
+    parser.add_argument("--max-periods", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-hours", type=int, default=10)
+    parser.add_argument("--hours-step", type=int, default=2)
+    args = parser.parse_args()
+
+    scaling_report(args.players, args.steps, args.max_periods, args.seed, args.max_hours, args.hours_step)
@@ -0,0 +1,82 @@
+"""
+    Allocation Problem - Auxiliary file to play a trained neural network without PyTorch
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import numpy as np
+
+"""Inference-only copy of Policy in deepRL_vs_ag: same network, weights held in NumPy arrays"""
+
+
+class NumpyPolicy:
+    def __init__(self, state_dict, seed=None, block_size=1024):
+        # weights of a Policy state_dict, given as tensors or arrays, transposed for inputs in rows
+        weights = {name: np.asarray(to_numpy(value), dtype=np.float64) for name, value in state_dict.items()}
+        self.w1 = np.ascontiguousarray(weights["fc1.weight"].T)  # (s_size, h_size)
+        self.b1 = weights["fc1.bias"]
+        self.w2 = np.ascontiguousarray(weights["fc2.weight"].T)  # (h_size, a_size)
+        self.b2 = weights["fc2.bias"]
+        self.a_size = len(self.b2)
+
+        # random numbers for sampling single actions, drawn in blocks
+        self.rng = np.random.default_rng(seed)
+        self.block_size = block_size
+        self.uniforms = []
+        self.uniform_pos = 0
+
+    # load weights from a checkpoint saved by deepRL_vs_ag (requires PyTorch only for reading the file)
+    @classmethod
+    def from_checkpoint(cls, path, seed=None):
+        import torch
+
+        saved = torch.load(path, map_location="cpu")
+        return cls(saved['model_state_dict'], seed)
+
+    # mixed strategies for a batch of states, shape (n, s_size) -> (n, a_size)
+    def probs(self, states):
+        hidden = np.maximum(states @ self.w1 + self.b1, 0)  # ReLU activation function
+        logits = hidden @ self.w2 + self.b2
+        logits -= logits.max(axis=-1, keepdims=True)
+        weights = np.exp(logits)
+        return weights / weights.sum(axis=-1, keepdims=True)  # weights are normalized to probabilities
+
+    # sample one action for each of a batch of states, using a given generator (default: own generator)
+    def sample(self, states, rng=None):
+        rng = self.rng if rng is None else rng
+        cdf = np.cumsum(self.probs(states), axis=-1)
+        actions = (rng.random((len(cdf), 1)) * cdf[:, -1:] >= cdf).sum(axis=-1)
+        return np.minimum(actions, self.a_size - 1)
+
+    # same interface as Policy.act: action as a number and logarithm of its probability
+    def act(self, state):
+        probs = self.probs(state)
+        cdf = np.cumsum(probs)
+
+        if self.uniform_pos == len(self.uniforms):
+            self.uniforms = self.rng.random(self.block_size).tolist()
+            self.uniform_pos = 0
+        self.uniform_pos += 1
+
+        action = min(int(np.searchsorted(cdf, self.uniforms[self.uniform_pos - 1] * cdf[-1], side="right")),
+                     self.a_size - 1)
+        return action, float(np.log(probs[action]))
+
+
+def to_numpy(value):
+    if hasattr(value, "detach"):  # PyTorch tensor
+        return value.detach().cpu().numpy()
+    return value
@@ -0,0 +1,148 @@
+"""
+    Allocation Problem - Successive halving search over hyperparameters of the neural network
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import argparse
+import math
+import multiprocessing as mp
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+import checkpoint
+from allocation_game import spawn_seeds
+from deepRL_vs_ag import create_policy, evaluate_batched, nn_hyperparameters, reinforce
+
+"""Successive halving: all configs are trained for a short budget, only the best 1/eta continue to eta times the budget
+
+    Training of a promoted config continues where it stopped (same random numbers as one long run), all configs are
+    evaluated on the same games, and the configs of a round are trained in parallel processes.
+"""
+
+
+# random configs: h_size from a list, lr log-uniform, 1 - gamma log-uniform (gamma close to 1 needs finer steps)
+def sample_configs(n_configs, h_sizes, lr_range, gamma_range, seed=None):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "h_size": int(rng.choice(h_sizes)),
+            "lr": float(np.exp(rng.uniform(np.log(lr_range[0]), np.log(lr_range[1])))),
+            "gamma": float(1 - np.exp(rng.uniform(np.log(1 - gamma_range[1]), np.log(1 - gamma_range[0])))),
+        }
+        for _ in range(n_configs)
+    ]
+
+
+# budgets in episodes of each round: min_episodes, eta * min_episodes, ... up to max_episodes
+def budgets(min_episodes, max_episodes, eta):
+    rounds = [min_episodes]
+    while rounds[-1] * eta <= max_episodes:
+        rounds.append(rounds[-1] * eta)
+    return rounds
+
+
+def init_worker():
+    torch.set_num_threads(1)  # one core per worker
+
+
+# worker: train config up to n_episodes (continuing from state if given), then evaluate on the fixed games
+# returns the training state to continue from and the mean efficiency of the evaluation
+def train_trial(config, n_episodes, state, seed, max_t, eval_episodes, eval_seed):
+    if state is None:
+        torch.manual_seed(int(seed.generate_state(1)[0]))  # initial weights, later rounds restore the random state
+    policy, optimizer = create_policy(config["h_size"], config["lr"])
+
+    memory = checkpoint.MemoryCheckpointer()
+    reinforce(policy, optimizer, n_episodes, max_t, config["gamma"], n_episodes + 1, seed=seed,
+              checkpointer=memory, checkpoint_every=n_episodes, resume=state)
+
+    summary = evaluate_batched(max_t, policy, eval_episodes, batch_size=eval_episodes, seed=eval_seed)
+    return memory.last, summary["mean"]["avg_efficiency"]
+
+
+def successive_halving(configs, min_episodes, max_episodes, eta=3, max_t=nn_hyperparameters["max_t"],
+                       eval_episodes=100, workers=None, seed=0):
+    *trial_seeds, eval_seed = spawn_seeds(seed, len(configs) + 1)
+    eval_seed = int(eval_seed.generate_state(1)[0])  # evaluation: same games for every config and round
+    states = [None] * len(configs)
+    scores = [None] * len(configs)
+    alive = list(range(len(configs)))
+
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"), initializer=init_worker) as pool:
+        rounds = budgets(min_episodes, max_episodes, eta)
+        for i_round, n_episodes in enumerate(rounds):
+            start = time.perf_counter()
+            futures = {
+                trial: pool.submit(train_trial, configs[trial], n_episodes, states[trial], trial_seeds[trial], max_t,
+                                   eval_episodes, eval_seed)
+                for trial in alive
+            }
+            for trial, future in futures.items():
+                states[trial], scores[trial] = future.result()
+
+            alive.sort(key=lambda trial: scores[trial], reverse=True)
+            print("round {}: {} configs trained for {} episodes in {:.1f} s".format(
+                i_round + 1, len(alive), n_episodes, time.perf_counter() - start))
+            for trial in alive:
+                print("    h_size {:>4}  lr {:.2e}  gamma {:.4f}  efficiency {:.4f}".format(
+                    configs[trial]["h_size"], configs[trial]["lr"], configs[trial]["gamma"], scores[trial]))
+
+            if i_round < len(rounds) - 1:
+                alive = alive[:max(1, math.ceil(len(alive) / eta))]
+                for trial in set(range(len(configs))) - set(alive):
+                    states[trial] = None  # free memory of stopped configs
+
+    best = alive[0]
+    return configs[best], states[best], scores[best]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search hyperparameters of the network by successive halving")
+    parser.add_argument("--configs", type=int, default=27, help="number of random configs in the first round")
+    parser.add_argument("--h-sizes", type=int, nargs="+", default=[5, 8, 16, 32, 64])
+    parser.add_argument("--lr-range", type=float, nargs=2, default=[1e-4, 1e-1])
+    parser.add_argument("--gamma-range", type=float, nargs=2, default=[0.9, 0.999])
+    parser.add_argument("--min-episodes", type=int, default=100, help="training budget of the first round")
+    parser.add_argument("--max-episodes", type=int, default=nn_hyperparameters["n_training_episodes"],
+                        help="largest training budget")
+    parser.add_argument("--eta", type=int, default=3, help="budget factor and inverse share of promoted configs")
+    parser.add_argument("--max-t", type=int, default=nn_hyperparameters["max_t"])
+    parser.add_argument("--eval-episodes", type=int, default=100, help="games of the evaluation (fixed seeds)")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--checkpoint", default="deepRL_vs_ag_search.pt", help="file to save the best model")
+    args = parser.parse_args(argv)
+
+    configs = sample_configs(args.configs, args.h_sizes, args.lr_range, args.gamma_range, args.seed)
+    config, state, score = successive_halving(configs, args.min_episodes, args.max_episodes, args.eta, args.max_t,
+                                              args.eval_episodes, args.workers, args.seed)
+
+    # same format as checkpoints of deepRL_vs_ag train, with the config (h_size is needed to load the model)
+    checkpoint.save_atomic({
+        'model_state_dict': state['model_state_dict'],
+        'optimizer_state_dict': state['optimizer_state_dict'],
+        'hyperparameters': config,
+    }, args.checkpoint)
+    print("best: h_size {} lr {:.2e} gamma {:.4f}, efficiency {:.4f}, saved to {}".format(
+        config["h_size"], config["lr"], config["gamma"], score, args.checkpoint))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+    Allocation Problem - Auxiliary file to profile training and simulation phase by phase
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+"""Profiler: instrumented code calls it only behind "if profiler is not None", so it costs nothing when disabled
+
+    start = profiler.clock()
+    ...  # phase 1
+    start = profiler.add("phase 1", start)  # returns end of phase 1 as start of the next phase
+    ...  # phase 2
+    profiler.add("phase 2", start)
+"""
+
+
+class Profiler:
+    def __init__(self, max_events=1000000):
+        self.max_events = max_events  # spans kept for the trace, totals and histograms include all spans
+        self.origin = time.perf_counter_ns()
+        self.events = []  # (name, start, duration, episode) in ns since origin
+        self.dropped = 0  # spans not kept for the trace
+
+        self.episode = 0  # number of finished episodes
+        self.calls = {}  # name: number of spans
+        self.totals = {}  # name: total duration in ns
+        self.current = {}  # name: duration in current episode
+        self.per_episode = {}  # name: list of durations per finished episode
+
+    clock = staticmethod(time.perf_counter_ns)
+
+    # record a span of phase name from start until now, returns now
+    def add(self, name, start):
+        end = time.perf_counter_ns()
+        duration = end - start
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.totals[name] = self.totals.get(name, 0) + duration
+        self.current[name] = self.current.get(name, 0) + duration
+
+        if len(self.events) < self.max_events:
+            self.events.append((name, start - self.origin, duration, self.episode))
+        else:
+            self.dropped += 1
+        return end
+
+    # close the current episode: its time per phase becomes one sample of the per-episode histograms
+    def end_episode(self):
+        for name in self.calls:
+            self.per_episode.setdefault(name, [0] * self.episode).append(self.current.get(name, 0))
+        self.current = {}
+        self.episode += 1
+
+    # histogram of time per episode (in ms) for each phase: name: (counts, bin edges)
+    def histograms(self, bins=20):
+        return {
+            name: np.histogram(np.array(durations) / 1e6, bins=bins) for name, durations in self.per_episode.items()
+        }
+
+    # table of phases, longest first; shares relative to outer phases (sub-phases like "calculate.policy" overlap)
+    def summary(self):
+        total = sum(duration for name, duration in self.totals.items() if "." not in name)
+        lines = ["{:<20}{:>10}{:>12}{:>8}{:>12}{:>14}{:>14}".format(
+            "phase", "calls", "total s", "share", "us/call", "ms/ep p50", "ms/ep p95")]
+        for name in sorted(self.totals, key=self.totals.get, reverse=True):
+            durations = np.array(self.per_episode.get(name, [np.nan])) / 1e6
+            lines.append("{:<20}{:>10}{:>12.3f}{:>8.1%}{:>12.2f}{:>14.3f}{:>14.3f}".format(
+                name,
+                self.calls[name],
+                self.totals[name] / 1e9,
+                self.totals[name] / total if total else 0,
+                self.totals[name] / self.calls[name] / 1e3,
+                np.percentile(durations, 50),
+                np.percentile(durations, 95),
+            ))
+        if self.dropped:
+            lines.append("({} spans not kept for the trace)".format(self.dropped))
+        return "\n".join(lines)
+
+    # trace events in Chrome's JSON format (chrome://tracing, https://ui.perfetto.dev), times in microseconds
+    def write_chrome_trace(self, path):
+        pid = os.getpid()
+        tid = threading.get_ident()
+        trace = {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "ph": "X",  # complete event: start and duration
+                    "ts": start / 1e3,
+                    "dur": duration / 1e3,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"episode": episode},
+                } for name, start, duration, episode in self.events
+            ],
+            "displayTimeUnit": "ms",
+        }
+        with open(path, "w") as file:
+            json.dump(trace, file)
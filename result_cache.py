@@ -0,0 +1,222 @@
+"""
+    Allocation Problem - Auxiliary file with a persistent cache of simulation and evaluation results
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+import pickle
+
+try:
+    import fcntl  # Unix
+except ImportError:
+    fcntl = None
+    import msvcrt  # Windows
+
+# directory of the cache, relative to the working directory like checkpoints and results
+default_directory = "result_cache"
+
+"""Keys: a hash of game settings, user strategy, policy, seed and code
+
+    Results are deterministic given these inputs, so the hash names them.
+"""
+
+
+# hash of any JSON serializable description of a result
+def make_key(**parts):
+    text = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+# hash of a file's content, e.g. a policy checkpoint; remembered while the file is unchanged
+def file_digest(path):
+    stat = os.stat(path)
+    return content_digest(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=None)
+def content_digest(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# version of the code computing a result: hash of its source files (any edit invalidates its cached results)
+def code_version(*paths):
+    return make_key(sources=[file_digest(path) for path in sorted(paths)])
+
+
+"""Lock on a file shared by all processes using the same cache"""
+
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+
+"""Cache: one pickled result per file, least recently used results are deleted when the cache exceeds max_bytes
+
+    Reading needs no lock (entries are written to a temporary file and renamed), writing and eviction hold the lock.
+    The modification time of an entry is its last use.
+"""
+
+
+class ResultCache:
+    def __init__(self, directory=default_directory, max_bytes=256 * 1024 ** 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = os.path.join(directory, "entries")
+        os.makedirs(self.entries, exist_ok=True)
+        self.lock = FileLock(os.path.join(directory, "lock"))
+        self.usage_path = os.path.join(directory, "usage")  # total bytes of entries, updated under the lock
+
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.entries, key[:2], key + ".pkl")
+
+    # cached result or default
+    def get(self, key, default=None):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):  # missing, or evicted while reading
+            self.misses += 1
+            return default
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self.lock:
+            usage = self.read_usage()
+            try:
+                usage -= os.path.getsize(path)  # replaced entry
+            except FileNotFoundError:
+                pass
+            temp_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+
+            usage += len(data)
+            if usage > self.max_bytes:
+                usage = self.evict(0.8 * self.max_bytes)  # some room, so that not every put evicts
+            self.write_usage(usage)
+
+    # cached result, or result of compute() which is then cached
+    def get_or_compute(self, key, compute):
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    # delete least recently used entries until at most target bytes remain (lock must be held), returns bytes left
+    def evict(self, target):
+        entries = []
+        for subdirectory in os.scandir(self.entries):
+            for entry in os.scandir(subdirectory.path):
+                if entry.name.endswith(".pkl"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        entries.sort()
+
+        usage = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if usage <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            usage -= size
+        return usage
+
+    def read_usage(self):
+        try:
+            with open(self.usage_path) as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            return self.evict(float("inf"))  # count all entries
+
+    def write_usage(self, usage):
+        with open(self.usage_path, "w") as file:
+            file.write(str(usage))
+
+    def clear(self):
+        with self.lock:
+            self.write_usage(self.evict(0))
+
+    def stats(self):
+        with self.lock:
+            usage = self.evict(float("inf"))
+            self.write_usage(usage)
+        n_entries = sum(len(os.listdir(entry.path)) for entry in os.scandir(self.entries))
+        return {"entries": n_entries, "bytes": usage, "max_bytes": self.max_bytes, "hits": self.hits,
+                "misses": self.misses}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or clear the result cache")
+    parser.add_argument("command", choices=["stats", "clear"])
+    parser.add_argument("--directory", default=default_directory)
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.directory)
+    if args.command == "clear":
+        cache.clear()
+    stats = cache.stats()
+    print("{} entries, {:.1f} MB of {:.0f} MB".format(stats["entries"], stats["bytes"] / 1e6, stats["max_bytes"] / 1e6))
+
+
+if __name__ == "__main__":
+    main()
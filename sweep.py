@@ -0,0 +1,334 @@
+"""
+    Allocation Problem - Parameter sweeps of the Q learning decision maker against scripted users
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import allocation_game
+from allocation_game import FastAllocationGame, spawn_seeds
+from result_cache import ResultCache, code_version, default_directory, make_key
+
+# hyperparameters of the decision maker that can be swept, a and b replace the random preference draws if given
+parameter_names = ["alpha0", "decay", "gamma_q", "exploration_periods", "sensitivity", "a", "b"]
+
+# example spec, used if no spec file is given
+default_spec = {
+    "mode": "grid",  # "grid": all combinations, "random": samples drawn from ranges
+    "parameters": {
+        "alpha0": [0.01, 0.05, 0.2],
+        "gamma_q": [0.5, 0.9],
+        "exploration_periods": [50, 100, 200],
+    },
+    "player_types": ["low", "high"],
+    "strategies": ["fair", "tit_for_tat", "alternate", "random"],
+    "n_games": 50,  # seeded games per config (same seeds for every config)
+    "seed": 0,
+    "game": {"max_periods": 200},  # other settings of FastAllocationGame
+}
+
+"""Scripted users: hours contributed in a period, given the period and the decision maker's previous contribution"""
+
+
+def user_fair(period, other_hours, rng, game):
+    return game.hours[len(game.hours) // 2 - 1]  # half the threshold on the default grid (4 hours)
+
+
+def user_zero(period, other_hours, rng, game):
+    return 0
+
+
+def user_high(period, other_hours, rng, game):
+    return game.hours[-2]  # enough for the bonus alone on the default grid (8 hours)
+
+
+def user_random(period, other_hours, rng, game):
+    return game.hours[rng.integers(len(game.hours))]
+
+
+def user_tit_for_tat(period, other_hours, rng, game):
+    return other_hours  # copy the decision maker, starting with 0
+
+
+def user_alternate(period, other_hours, rng, game):
+    return 0 if period % 2 == 0 else game.hours[len(game.hours) // 2 - 1]  # like the trained network: 0, 4, 0, ...
+
+
+strategies = {
+    "fair": user_fair,
+    "zero": user_zero,
+    "high": user_high,
+    "random": user_random,
+    "tit_for_tat": user_tit_for_tat,
+    "alternate": user_alternate,
+}
+
+
+"Configs"
+
+
+# list of configs (dicts of parameters, player_type and strategy) described by a spec
+def expand_spec(spec):
+    parameters = spec.get("parameters", {})
+    unknown = set(parameters) - set(parameter_names)
+    if unknown:
+        raise ValueError("unknown parameters: {}".format(", ".join(sorted(unknown))))
+
+    if spec.get("mode", "grid") == "grid":
+        names = sorted(parameters)
+        points = [dict(zip(names, values)) for values in itertools.product(*(parameters[name] for name in names))]
+    else:  # random search: {"low": x, "high": y, "log": true/false} or list of choices for each parameter
+        rng = np.random.default_rng(spec.get("seed", 0))
+        points = []
+        for _ in range(spec["samples"]):
+            point = {}
+            for name, space in sorted(parameters.items()):
+                if isinstance(space, list):
+                    point[name] = space[rng.integers(len(space))]
+                elif space.get("log"):
+                    point[name] = float(np.exp(rng.uniform(np.log(space["low"]), np.log(space["high"]))))
+                else:
+                    point[name] = float(rng.uniform(space["low"], space["high"]))
+                if name == "exploration_periods":
+                    point[name] = max(int(round(point[name])), 1)
+            points.append(point)
+
+    return [
+        dict(point, player_type=player_type, strategy=strategy)
+        for point in points
+        for player_type in spec.get("player_types", ["low"])
+        for strategy in spec.get("strategies", ["fair"])
+    ]
+
+
+# play n_games seeded games of one config, returns summary statistics
+def run_config(config, n_games, seed, game_settings):
+    settings = dict(game_settings)
+    settings.update({name: config[name] for name in parameter_names[:5] if name in config})
+    user = strategies[config["strategy"]]
+
+    periods = []
+    efficiencies = []
+    final_r = []
+    contributions_h = []
+    contributions_l = []
+    for game_seed in spawn_seeds(seed, n_games):
+        game = FastAllocationGame(player_type=config["player_type"], seed=game_seed, **settings)
+        game.reset()
+        if "a" in config:
+            game.a = config["a"]
+        if "b" in config:
+            game.b = config["b"]
+        rng = np.random.default_rng(game_seed.spawn(1)[0])  # user's random numbers
+
+        total_payoff = 0.0
+        total_h = 0.0
+        total_l = 0.0
+        other_hours = 0
+        done = False
+        while not done:
+            hours = user(game.period, other_hours, rng, game)
+            done = game.step(game.hours.index(hours))
+            total_payoff += game.own_payoff + game.other_payoff
+            total_h += game.contribution_h
+            total_l += game.contribution_l
+            other_hours = game.contribution_l if config["player_type"] == "low" else game.contribution_h
+
+        periods.append(game.period)
+        efficiencies.append(total_payoff / game.period / game.max_total_payoff)
+        final_r.append(game.r)
+        contributions_h.append(total_h / game.period)
+        contributions_l.append(total_l / game.period)
+
+    contribution_h = float(np.mean(contributions_h))
+    contribution_l = float(np.mean(contributions_l))
+    return {
+        "periods_mean": float(np.mean(periods)),
+        "periods_std": float(np.std(periods)),
+        "terminated": float(np.mean(np.array(periods) < settings.get("max_periods", 1000))),  # ended by repetition
+        "efficiency_mean": float(np.mean(efficiencies)),
+        "efficiency_std": float(np.std(efficiencies)),
+        "r_final_mean": float(np.mean(final_r)),
+        "contribution_h_mean": contribution_h,
+        "contribution_l_mean": contribution_l,
+        "share_h": contribution_h / (contribution_h + contribution_l) if contribution_h + contribution_l > 0 else 0.0,
+    }
+
+
+"""Columnar results: one binary file per column, rows are appended as configs finish"""
+
+summary_columns = [
+    "periods_mean", "periods_std", "terminated", "efficiency_mean", "efficiency_std", "r_final_mean",
+    "contribution_h_mean", "contribution_l_mean", "share_h",
+]
+
+
+class ResultsWriter:
+    def __init__(self, directory, spec):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+        # columns: config id, categories as codes, parameters (nan if not swept), summary statistics
+        self.categories = {"player_type": ["low", "high"], "strategy": sorted(strategies)}
+        self.columns = [("config", "<i8")]
+        self.columns += [(name, "<i2") for name in self.categories]
+        self.columns += [(name, "<f8") for name in parameter_names]
+        self.columns += [(name, "<f8") for name in summary_columns]
+
+        with open(os.path.join(directory, "columns.json"), "w") as file:
+            json.dump({"columns": self.columns, "categories": self.categories, "spec": spec}, file, indent=2)
+        self.files = {name: open(os.path.join(directory, name + ".bin"), "wb") for name, _ in self.columns}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, config_id, config, summary):
+        for name, dtype in self.columns:
+            if name == "config":
+                value = config_id
+            elif name in self.categories:
+                value = self.categories[name].index(config[name])
+            elif name in summary:
+                value = summary[name]
+            else:
+                value = config.get(name, np.nan)
+            self.files[name].write(np.array(value, dtype=dtype).tobytes())
+            self.files[name].flush()  # readable while the sweep is running
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+
+# columns as arrays (rows in order of completion), categories decoded to strings
+def load_results(directory):
+    with open(os.path.join(directory, "columns.json")) as file:
+        schema = json.load(file)
+    results = {}
+    for name, dtype in schema["columns"]:
+        values = np.fromfile(os.path.join(directory, name + ".bin"), dtype=dtype)
+        if name in schema["categories"]:
+            values = np.array(schema["categories"][name])[values]
+        results[name] = values
+    n_rows = min(len(values) for values in results.values())  # last row may be incomplete while running
+    return {name: values[:n_rows] for name, values in results.items()}
+
+
+# run all configs of spec, configs found in cache (a ResultCache) are not played again
+def run_sweep(spec, directory, workers=None, cache=None):
+    configs = expand_spec(spec)
+    n_games = spec.get("n_games", 50)
+    seed = spec.get("seed", 0)
+    game_settings = spec.get("game", {})
+
+    start = time.perf_counter()
+    with ResultsWriter(directory, spec) as writer, ProcessPoolExecutor(max_workers=workers) as pool:
+        done = 0
+        keys = {}
+        futures = {}
+        for config_id, config in enumerate(configs):
+            if cache is not None:
+                keys[config_id] = cache_key(config, n_games, seed, game_settings)
+                summary = cache.get(keys[config_id])
+                if summary is not None:
+                    writer.append(config_id, config, summary)
+                    done += 1
+                    continue
+            futures[pool.submit(run_config, config, n_games, seed, game_settings)] = config_id
+
+        for future in as_completed(futures):
+            config_id = futures[future]
+            summary = future.result()
+            writer.append(config_id, configs[config_id], summary)
+            if cache is not None:
+                cache.put(keys[config_id], summary)
+            done += 1
+            print("\r{}/{} configs".format(done, len(configs)), end="", flush=True)
+    print("\n{} configs of {} games in {:.1f} s ({} from cache)".format(
+        len(configs), n_games, time.perf_counter() - start, len(configs) - len(futures)))
+
+
+# key of a config's summary: everything that determines the games (the user strategy is part of config)
+def cache_key(config, n_games, seed, game_settings):
+    return make_key(
+        result="sweep",
+        config=config,
+        n_games=n_games,
+        seed=seed,
+        game=game_settings,
+        code=code_version(allocation_game.__file__, __file__),
+    )
+
+
+# best configs by efficiency
+def show_results(directory, top=10):
+    results = load_results(directory)
+    order = np.argsort(-results["efficiency_mean"])[:top]
+    swept = [name for name in parameter_names if not np.isnan(results[name]).all()]
+    header = ["player_type", "strategy"] + swept + ["efficiency_mean", "periods_mean", "r_final_mean", "share_h"]
+    widths = [max(len(name) + 2, 12) for name in header]
+    print("".join("{:>{}}".format(name, width) for name, width in zip(header, widths)))
+    for row in order:
+        print("".join(
+            "{:>{}}".format(results[name][row], width) if isinstance(results[name][row], str)
+            else "{:>{}.4g}".format(results[name][row], width)
+            for name, width in zip(header, widths)
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parameter sweep of the Q learning decision maker")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run a sweep")
+    run_parser.add_argument("--spec", default=None, help="JSON file with the sweep (default: example spec)")
+    run_parser.add_argument("--output", default="sweep_results", help="directory of the columnar results")
+    run_parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    run_parser.add_argument("--cache", default=default_directory, help="directory of cached results")
+    run_parser.add_argument("--no-cache", action="store_true", help="play all configs again")
+
+    show_parser = subparsers.add_parser("show", help="print best configs of a sweep")
+    show_parser.add_argument("directory", nargs="?", default="sweep_results")
+    show_parser.add_argument("--top", type=int, default=10)
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        spec = default_spec
+        if args.spec is not None:
+            with open(args.spec) as file:
+                spec = json.load(file)
+        cache = None
+        if not args.no_cache:
+            cache = ResultCache(args.cache)
+        run_sweep(spec, args.output, args.workers, cache)
+        show_results(args.output)
+    else:
+        show_results(args.directory, args.top)
+
+
+if __name__ == "__main__":
+    main()
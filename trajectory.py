@@ -0,0 +1,102 @@
+"""
+    Allocation Problem - Auxiliary file to record the history of a game
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import numpy as np
+
+# one record per period, field names as used for the plots in project_functions
+trajectory_dtype = np.dtype([
+    ("totpaydyn", np.float64),  # total payoff
+    ("indpayH", np.float64),  # payoff player H
+    ("indpayL", np.float64),  # payoff player L
+    ("indcontH", np.float64),  # contribution player H
+    ("indcontL", np.float64),  # contribution player L
+    ("kindness", np.float64),  # kindness of computer agent
+    ("reward_hist", np.float64),  # reward earned by Q learning algorithm
+])
+
+
+class TrajectoryRecorder:
+    def __init__(self, max_periods, max_total_payoff=42):
+        self.data = np.zeros(max_periods, dtype=trajectory_dtype)  # preallocated for a full game
+        self.length = 0  # number of recorded periods
+        self.max_total_payoff = max_total_payoff  # normalizes total payoff to efficiency
+
+        # running averages shown on exit window
+        self.avg_reward = 0.0
+        self.avg_efficiency = 0.0
+        self.avg_contribution_h = 0.0
+        self.avg_contribution_l = 0.0
+
+    # forget all recorded periods, but keep the memory
+    def reset(self):
+        self.length = 0
+        self.avg_reward = 0.0
+        self.avg_efficiency = 0.0
+        self.avg_contribution_h = 0.0
+        self.avg_contribution_l = 0.0
+
+    # record one period, same values as returned by AllocationGame.calculate
+    def append(self, payoff_h, payoff_l, contribution_h, contribution_l, reward_q, r):
+        if self.length == len(self.data):  # game continued past its maximum length, double the memory
+            self.data = np.concatenate([self.data, np.zeros(len(self.data), dtype=trajectory_dtype)])
+
+        self.data[self.length] = (payoff_h + payoff_l, payoff_h, payoff_l, contribution_h, contribution_l, r, reward_q)
+        self.length += 1
+
+        # update running averages
+        n = self.length
+        self.avg_reward += (reward_q - self.avg_reward) / n
+        self.avg_efficiency += ((payoff_h + payoff_l) / self.max_total_payoff - self.avg_efficiency) / n
+        self.avg_contribution_h += (contribution_h - self.avg_contribution_h) / n
+        self.avg_contribution_l += (contribution_l - self.avg_contribution_l) / n
+
+    def __len__(self):
+        return self.length
+
+    # view of one column for the recorded periods (no copy)
+    def column(self, name):
+        return self.data[name][:self.length]
+
+    @property
+    def totpaydyn(self):
+        return self.column("totpaydyn")
+
+    @property
+    def indpayH(self):
+        return self.column("indpayH")
+
+    @property
+    def indpayL(self):
+        return self.column("indpayL")
+
+    @property
+    def indcontH(self):
+        return self.column("indcontH")
+
+    @property
+    def indcontL(self):
+        return self.column("indcontL")
+
+    @property
+    def kindness(self):
+        return self.column("kindness")
+
+    @property
+    def reward_hist(self):
+        return self.column("reward_hist")
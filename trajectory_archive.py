@@ -0,0 +1,210 @@
+"""
+    Allocation Problem - Auxiliary file to archive trajectories of many games on disk
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import glob
+import os
+
+import numpy as np
+
+# one record per period and game
+archive_dtype = np.dtype([
+    ("episode", np.int64),
+    ("period", np.int32),
+    ("contribution_h", np.float32),
+    ("contribution_l", np.float32),
+    ("payoff_h", np.float32),
+    ("payoff_l", np.float32),
+    ("reward_q", np.float64),
+    ("r", np.float64),
+    ("count", np.int32),
+])
+
+# one entry per finished episode: where its records are stored
+index_dtype = np.dtype([
+    ("episode", np.int64),
+    ("segment", np.int32),
+    ("start", np.int64),
+    ("length", np.int64),
+])
+
+
+def segment_path(directory, segment):
+    return os.path.join(directory, "segment_{:05d}.npy".format(segment))
+
+
+# index entries are appended to a raw file, the number of complete entries is stored separately
+def index_path(directory):
+    return os.path.join(directory, "index.bin")
+
+
+def count_path(directory):
+    return os.path.join(directory, "index_count")
+
+
+def read_count(directory):
+    try:
+        with open(count_path(directory)) as file:
+            return int(file.read())
+    except FileNotFoundError:
+        return 0
+
+
+# first count entries of the index, memory-mapped
+def read_index(directory, count):
+    if count == 0:
+        return np.zeros(0, dtype=index_dtype)
+    return np.memmap(index_path(directory), dtype=index_dtype, mode="r", shape=(count, ))
+
+
+"""Writer: appends episodes to fixed-size memory-mapped segments, records of an episode never span two segments"""
+
+
+class TrajectoryArchiveWriter:
+    def __init__(self, directory, segment_size=1 << 20, flush_every=1000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.flush_every = flush_every  # number of episodes between updates of the index on disk
+
+        # continue an existing archive, entries beyond the stored count are from an interrupted flush
+        self.n_indexed = read_count(directory)  # entries on disk
+        with open(index_path(directory), "ab") as file:
+            file.truncate(self.n_indexed * index_dtype.itemsize)
+        self.pending = []  # entries of finished episodes not yet on disk
+
+        if self.n_indexed:
+            _, self.segment_number, start, length = read_index(directory, self.n_indexed)[-1].tolist()
+            self.segment = np.lib.format.open_memmap(segment_path(directory, self.segment_number), mode="r+")
+            self.segment_size = len(self.segment)
+            self.position = start + length
+        else:
+            self.segment_number = -1
+            self.segment = None
+            self.segment_size = segment_size
+            self.position = segment_size  # no space left, first record opens a segment
+
+        self.episode = self.n_indexed  # id of next episode
+        self.episode_start = None  # position of current episode's first record
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # open the next segment and move the records of the unfinished episode there
+    def new_segment(self):
+        previous = self.segment
+        self.segment_number += 1
+        self.segment = np.lib.format.open_memmap(
+            segment_path(self.directory, self.segment_number),
+            mode="w+",
+            dtype=archive_dtype,
+            shape=(self.segment_size, ),
+        )
+
+        if previous is not None:
+            previous.flush()
+        if self.episode_start is not None:
+            length = self.position - self.episode_start
+            if length > 0:
+                self.segment[:length] = previous[self.episode_start:self.position]
+            self.episode_start = 0
+            self.position = length
+        else:
+            self.position = 0
+
+    # start recording a new episode, returns its id
+    def begin_episode(self):
+        self.episode_start = self.position
+        return self.episode
+
+    # record one period of the current episode
+    def append(self, period, contribution_h, contribution_l, payoff_h, payoff_l, reward_q, r, count):
+        if self.position == self.segment_size:
+            if self.episode_start == 0:
+                raise ValueError("episode is longer than a segment of {} periods".format(self.segment_size))
+            self.new_segment()
+
+        self.segment[self.position] = (
+            self.episode, period, contribution_h, contribution_l, payoff_h, payoff_l, reward_q, r, count
+        )
+        self.position += 1
+
+    # finish the current episode and add it to the index
+    def end_episode(self):
+        self.pending.append((self.episode, self.segment_number, self.episode_start, self.position - self.episode_start))
+        self.episode += 1
+        self.episode_start = None
+
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    # write records and new index entries to disk, then replace the count atomically (only new entries are written)
+    def flush(self):
+        if self.segment is not None:
+            self.segment.flush()
+        if self.pending:
+            with open(index_path(self.directory), "ab") as file:
+                file.write(np.array(self.pending, dtype=index_dtype).tobytes())
+            self.n_indexed += len(self.pending)
+            self.pending = []
+
+        temporary = count_path(self.directory) + ".tmp"
+        with open(temporary, "w") as file:
+            file.write(str(self.n_indexed))
+        os.replace(temporary, count_path(self.directory))
+
+    def close(self):
+        self.flush()
+        self.segment = None
+
+
+"""Reader: zero-copy access to archived episodes"""
+
+
+class TrajectoryArchive:
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = read_index(directory, read_count(directory))
+        n_segments = len(glob.glob(os.path.join(directory, "segment_*.npy")))
+        self.segments = [None] * n_segments  # memory maps, opened on first access
+
+    def __len__(self):
+        return len(self.index)
+
+    def segment(self, number):
+        if self.segments[number] is None:
+            self.segments[number] = np.load(segment_path(self.directory, number), mmap_mode="r")
+        return self.segments[number]
+
+    # records of one episode
+    def episode(self, episode):
+        _, segment, start, length = self.index[episode]
+        return self.segment(segment)[start:start + length]
+
+    # records of episodes first, ..., last - 1 as a list of views, one per segment
+    def episodes(self, first=0, last=None):
+        entries = self.index[first:last]
+        views = []
+        for segment in np.unique(entries["segment"]):
+            in_segment = entries[entries["segment"] == segment]
+            start = in_segment["start"][0]
+            stop = in_segment["start"][-1] + in_segment["length"][-1]
+            views.append(self.segment(segment)[start:stop])
+        return views
@@ -0,0 +1,190 @@
+"""
+    Allocation Problem - Auxiliary file with batched game specifications
+
+    Copyright (C) 2024, Needs and Ambitions
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+import numpy as np
+
+from allocation_game import contribution_grid, max_total_payoff, payoff_table
+
+"""Setup for batched environment: n independent allocation games against Qlearning algorithms, advanced in lockstep"""
+
+
+class VecAllocationGame:
+    def __init__(self,
+                 n_games,
+                 alpha0=0.05,
+                 decay=0.005,
+                 gamma_q=0.9,
+                 exploration_periods=100,
+                 max_periods=1000,
+                 sensitivity=0.1,
+                 player_type="low",
+                 seed=None,
+                 max_hours=10,
+                 hours_step=2,
+                 threshold=8,
+                 bonus=25,
+                 cost_h=3,
+                 cost_l=1):
+        super(VecAllocationGame, self).__init__()
+        self.n_games = n_games
+        self.player_type = player_type  # same player type for all games
+
+        # grid of contributions (same as AllocationGame), default: own contribution 0, 2, ..., 10 in each state
+        self.max_hours = max_hours
+        self.hours_step = hours_step
+        self.hours = np.array(contribution_grid(max_hours, hours_step))
+        self.n_actions = len(self.hours)
+
+        # payoff tables indexed by [agent's action, user's action]
+        rewards_l = payoff_table(self.hours, threshold, bonus, cost_l)
+        rewards_h = payoff_table(self.hours, threshold, bonus, cost_h)
+        self.max_total_payoff = max_total_payoff(rewards_l, rewards_h)
+
+        rewards_l = np.array(rewards_l)
+        rewards_h = np.array(rewards_h)
+        if player_type == "low":
+            self.own_payoffs, self.other_payoffs = rewards_l, rewards_h.T
+        else:
+            self.own_payoffs, self.other_payoffs = rewards_h, rewards_l.T
+
+        # one table of floats per game, with cached maximum of each row (cf. AllocationGame.set_q_value)
+        self.Q_values = np.zeros((n_games, self.n_actions, self.n_actions))
+        self.Q_max = np.zeros((n_games, self.n_actions))
+        self.Q_argmax = np.zeros((n_games, self.n_actions), dtype=int)
+
+        # hyperparameters (shared by all games)
+        self.alpha0 = alpha0  # initial learning rate
+        self.decay = decay  # decay of learning rate
+        self.gamma_q = gamma_q  # discounting factor
+        self.exploration_periods = exploration_periods  # length of exploration phase
+        self.max_periods = max_periods  # maximum length of game
+        self.sensitivity = sensitivity  # increment of changes to kindness
+
+        self.rng = np.random.default_rng(seed)  # random numbers of all games in this batch
+
+        # preference parameters, one draw per game
+        self.a = self.rng.random(n_games)  # decision weight for advantageous inequality, "greed"
+        self.b = self.rng.random(n_games)  # d.w. for disadvantageous ineq., "envy"
+
+        # initialization
+        self.count = np.zeros(n_games, dtype=int)
+        self.contribution_h_old = np.zeros(n_games)
+        self.contribution_l_old = np.zeros(n_games)
+        self.period = np.zeros(n_games, dtype=int)
+        self.r = np.zeros(n_games)  # initial kindness
+
+        self._games = np.arange(n_games)  # row index used for per-game table lookups
+
+    # epsilon-greedy choice for all games at once, epsilon and state are arrays of length n_games
+    def epsilon_greedy_policy(self, state, epsilon):
+        explore = self.rng.random(self.n_games) < epsilon
+        action = self.Q_argmax[self._games, state]
+        action[explore] = self.rng.integers(0, self.n_actions, size=np.count_nonzero(explore))
+        return action
+
+    # write one Q value per game and update the cached row maxima, rows that lose their maximum are searched again
+    def set_q_values(self, state, action, value):
+        self.Q_values[self._games, state, action] = value
+        best = self.Q_argmax[self._games, state]
+        best_value = self.Q_max[self._games, state]
+
+        improved = (value > best_value) | ((value == best_value) & (action <= best))
+        self.Q_max[self._games[improved], state[improved]] = value[improved]
+        self.Q_argmax[self._games[improved], state[improved]] = action[improved]
+
+        decreased = (action == best) & (value < best_value)
+        if decreased.any():
+            games = self._games[decreased]
+            rows = self.Q_values[games, state[decreased]]
+            self.Q_argmax[games, state[decreased]] = np.argmax(rows, axis=1)
+            self.Q_max[games, state[decreased]] = np.max(rows, axis=1)
+
+    # reset all games, or only those selected by a boolean mask
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.n_games, dtype=bool)
+        n = np.count_nonzero(mask)
+        if n == 0:
+            return
+
+        self.count[mask] = 0
+        self.contribution_h_old[mask] = 0
+        self.contribution_l_old[mask] = 0
+        self.a[mask] = self.rng.random(n)
+        self.b[mask] = self.rng.random(n)
+        self.r[mask] = 0
+        self.period[mask] = 0
+        self.Q_values[mask] = 0
+        self.Q_max[mask] = 0
+        self.Q_argmax[mask] = 0
+
+    # advance every game one period, finished games are reset automatically
+    def step(self, actions):
+        actions = np.asarray(actions)
+        epsilon = np.maximum(1 - self.period / self.exploration_periods, 0.01)  # probability of random choice
+
+        # determine computer agents' next actions, accounting for player type
+        if self.player_type == "low":
+            state_q = (self.contribution_h_old / self.hours_step).astype(int)  # determine previous states
+            action_q = self.epsilon_greedy_policy(state_q, epsilon)  # determine next actions
+
+            contribution_l = self.hours[action_q]
+            contribution_h = self.hours[actions]  # users' input
+        else:
+            state_q = (self.contribution_l_old / self.hours_step).astype(int)  # determine previous states
+            action_q = self.epsilon_greedy_policy(state_q, epsilon)  # determine next actions
+
+            contribution_h = self.hours[action_q]
+            contribution_l = self.hours[actions]  # users' input
+
+        # convert user input into action, as in AllocationGame.calculate
+        next_state = (actions / self.hours_step).astype(int)
+
+        # update endgame counters
+        repeated = (contribution_h == self.contribution_h_old) & (contribution_l == self.contribution_l_old)
+        self.count = np.where(repeated, self.count + 1, 0)
+
+        # look up payoffs
+        own_payoff = self.own_payoffs[action_q, actions]
+        other_payoff = self.other_payoffs[action_q, actions]
+
+        # determine computer agents' utilities (cf. Charness & Rabin, 2002, QJE) and update kindness
+        kind = own_payoff >= other_payoff  # user is kind to agent
+        weight = np.where(kind, self.a, self.b)
+        reward_q = weight * own_payoff + self.r * (1 - weight) * other_payoff
+        self.r = self.r + np.where(kind, self.sensitivity, -self.sensitivity)
+
+        next_value = self.Q_max[self._games, next_state]  # determine best responses to users' actions
+        alpha = self.alpha0 / (1 + self.period * self.decay)  # determine learning rates
+        q_values = self.Q_values[self._games, state_q, action_q] * (1 - alpha)  # discount previous Q values
+        self.set_q_values(state_q, action_q, q_values + alpha * (reward_q + self.gamma_q * next_value))  # update
+
+        # prepare next period
+        self.contribution_h_old = contribution_h.astype(float)
+        self.contribution_l_old = contribution_l.astype(float)
+        self.period = self.period + 1
+
+        # check which games should be terminated
+        done = (self.count >= 5) | (self.period == self.max_periods)
+        r = self.r.copy()
+        count = self.count.copy()
+        period = self.period.copy()
+        self.reset(done)
+
+        return other_payoff, own_payoff, contribution_h, contribution_l, reward_q, r, count, period, done